@@ -3,6 +3,15 @@ from .models import Vendor,PurchaseOrder,HistoricalPerformance
 
 # Register your models here.
 
-admin.site.register(Vendor)
-admin.site.register(PurchaseOrder)
-admin.site.register(HistoricalPerformance)
\ No newline at end of file
+# Deletes vendors and purchase orders through the bulk delete path, which skips the per-order metric signals
+class BulkDeleteAdmin(admin.ModelAdmin):
+    def delete_model(self, request, obj):
+        self.model.objects.filter(pk=obj.pk).bulk_delete()
+
+    def delete_queryset(self, request, queryset):
+        queryset.bulk_delete()
+
+
+admin.site.register(Vendor, BulkDeleteAdmin)
+admin.site.register(PurchaseOrder, BulkDeleteAdmin)
+admin.site.register(HistoricalPerformance)
@@ -0,0 +1,184 @@
+import functools
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Vendor, PurchaseOrder, HistoricalPerformance
+from .serializer import VendorSerializer, PurchaseOrderSerializer, HistoricalPerformanceSerializer, \
+    PerformanceAsOfSerializer, HistoricalPerformanceQuerySerializer, PerformanceFeedQuerySerializer
+from .pagination import PurchaseOrderPagination, HistoricalPerformancePagination
+from .performance_cache import aget_performance_entry
+from .rollups import metrics_as_of
+from .database import read_alias
+from .authentication import CachedTokenAuthentication
+from .change_feed import change_feed
+
+# Async versions of the read-heavy endpoints. Under ASGI they wait on the database without holding a worker
+# thread, so many polling dashboards can share one process. Writes stay on the DRF viewsets in views.py.
+
+
+# Returns the user of a request from its "Authorization: Token <key>" header or its session, like the
+# CachedTokenAuthentication and SessionAuthentication classes configured for DRF, but through the async ORM
+async def aauthenticate(request):
+    header = request.headers.get('Authorization', '').split()
+    if header and header[0].lower() == 'token':
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        user, _ = await CachedTokenAuthentication().aauthenticate_credentials(header[1])
+        return user
+    user = await request.auser()
+    if not user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+    return user
+
+
+def api_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+# Wraps an async read view with authentication and renders API errors as JSON, the way DRF does for the
+# sync viewsets. Errors are 403 as there, since SessionAuthentication comes first and sends no challenge.
+def async_api_view(view):
+    @require_safe
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            request.user = await aauthenticate(request)
+            return await view(Request(request), *args, **kwargs)
+        except exceptions.APIException as exc:
+            status = 403 if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)) \
+                else exc.status_code
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return api_response(detail, status=status)
+    return wrapper
+
+
+@async_api_view
+async def vendor_detail(request, vendor_code):
+    vendor = await Vendor.objects.filter(pk=vendor_code).afirst()
+    if vendor is None:
+        raise exceptions.NotFound('No Vendor matches the given query.')
+    return api_response(VendorSerializer(vendor).data)
+
+
+# Same responses as VendorViewSet.performance, including ETag and Last-Modified validation and ?as_of
+@async_api_view
+async def vendor_performance(request, vendor_code):
+    query = PerformanceAsOfSerializer(data={'as_of': request.query_params['as_of']}
+                                      if request.query_params.get('as_of') else {})
+    query.is_valid(raise_exception=True)
+    as_of = query.validated_data.get('as_of')
+    if as_of is not None:
+        metrics = (await sync_to_async(metrics_as_of)([vendor_code], as_of)).get(vendor_code)
+        if metrics is None:
+            if not await Vendor.objects.filter(pk=vendor_code).aexists():
+                raise exceptions.NotFound('No Vendor matches the given query.')
+            raise exceptions.NotFound('No performance snapshot at or before as_of.')
+        return api_response(metrics)
+
+    entry = await aget_performance_entry(vendor_code)
+    if entry is None:
+        raise exceptions.NotFound('No Vendor matches the given query.')
+    last_modified = int(entry['last_modified'].timestamp()) if entry['last_modified'] else None
+    response = get_conditional_response(request._request, etag=entry['etag'], last_modified=last_modified)
+    if response is None:
+        response = api_response(entry['metrics'])
+    response['ETag'] = entry['etag']
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+# Same pages as PurchaseOrderViewSet.list, filtered by ?vendor__vendor_code
+@async_api_view
+async def purchase_order_list(request):
+    queryset = PurchaseOrder.objects.using(read_alias())
+    if request.query_params.get('vendor__vendor_code'):
+        queryset = queryset.filter(vendor_id=request.query_params['vendor__vendor_code'])
+    data = await PurchaseOrderPagination().apaginate(
+        queryset, request, lambda page: PurchaseOrderSerializer(page, many=True).data)
+    return api_response(data)
+
+
+# Same pages as HistoricalPerformanceViewSet.list, filtered by ?vendor__vendor_code, ?date__gte and ?date__lte
+@async_api_view
+async def historical_performance_list(request):
+    query = HistoricalPerformanceQuerySerializer(
+        data={name: value for name, value in request.query_params.items() if value})
+    query.is_valid(raise_exception=True)
+    queryset = HistoricalPerformance.objects.using(read_alias()).filter(**query.validated_data)
+    data = await HistoricalPerformancePagination().apaginate(
+        queryset, request, lambda page: HistoricalPerformanceSerializer(page, many=True).data)
+    return api_response(data)
+
+
+# Snapshots sent per step of the change feed
+FEED_BATCH_SIZE = 100
+
+
+# Streams the snapshots after the cursor as server-sent events whose id is the snapshot id, so a reconnecting
+# EventSource resumes from its Last-Event-ID. Sends a comment line every CHANGE_FEED_HEARTBEAT seconds when idle.
+async def performance_events(vendor_code, after_id):
+    heartbeat = getattr(settings, 'CHANGE_FEED_HEARTBEAT', 15)
+    seen = after_id
+    while True:
+        # Taken before the read, so a snapshot committed during it still wakes the wait below
+        seen = max(seen, change_feed.latest_id)
+        rows = await change_feed.rows_after(after_id, vendor_code, FEED_BATCH_SIZE)
+        for row in rows:
+            data = json.dumps(HistoricalPerformanceSerializer(row).data, cls=JSONEncoder)
+            yield f'id: {row.id}\nevent: performance\ndata: {data}\n\n'
+        if rows:
+            after_id = rows[-1].id
+            seen = max(seen, after_id)
+            if len(rows) == FEED_BATCH_SIZE:
+                continue
+        if await change_feed.wait(seen, heartbeat) is None:
+            yield ': keepalive\n\n'
+
+
+# Change feed of historical performance snapshots, optionally of one ?vendor__vendor_code, after the ?after cursor
+# (or the Last-Event-ID header). Without a cursor it starts at the newest snapshot. Clients that accept
+# text/event-stream get a server-sent event stream; others get a long poll that returns as soon as there are
+# snapshots, or empty after ?timeout seconds, with the cursor to ask from next. Snapshots are read from the
+# primary, since a lagging replica could miss rows the feed was just told about.
+@async_api_view
+async def performance_feed(request):
+    data = {name: value for name, value in request.query_params.items() if value}
+    if 'after' not in data and request.headers.get('Last-Event-ID'):
+        data['after'] = request.headers['Last-Event-ID']
+    query = PerformanceFeedQuerySerializer(data=data)
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    vendor_code = params.get('vendor__vendor_code')
+    after_id = params.get('after')
+    if after_id is None:
+        after_id = await change_feed.newest_id() or 0
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(performance_events(vendor_code, after_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Keeps nginx from buffering the stream
+        return response
+
+    # Snapshots of other vendors also wake the wait, so it is repeated until one matches or the time is up
+    deadline = time.monotonic() + params['timeout']
+    seen = max(after_id, change_feed.latest_id)
+    rows = await change_feed.rows_after(after_id, vendor_code, FEED_BATCH_SIZE)
+    while not rows and deadline > time.monotonic():
+        seen = await change_feed.wait(seen, deadline - time.monotonic())
+        if seen is None:
+            break
+        rows = await change_feed.rows_after(after_id, vendor_code, FEED_BATCH_SIZE)
+    return api_response({
+        'cursor': rows[-1].id if rows else after_id,
+        'results': HistoricalPerformanceSerializer(rows, many=True).data,
+    })
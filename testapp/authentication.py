@@ -0,0 +1,161 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+SHARED_KEY_PREFIX = 'auth-token:'
+
+
+# In-process LRU of the user entries of checked tokens, which expire after local_ttl() seconds. Settings are read per
+# call so tests can override them.
+class TokenCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        ttl = local_ttl()
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000):
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+# Returns the cache shared between processes named by AUTH_TOKEN_SHARED_CACHE, or None if it is not configured
+def shared_token_cache():
+    alias = getattr(settings, 'AUTH_TOKEN_SHARED_CACHE', None)
+    return caches[alias] if alias else None
+
+
+# Returns the seconds a checked token is remembered (AUTH_TOKEN_CACHE_TTL, 0 turns the caches off)
+def cache_ttl():
+    return getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60)
+
+
+# Returns the seconds an entry lives in the in-process LRU. In front of a shared cache it is at most
+# AUTH_TOKEN_LOCAL_TTL, which bounds how long other processes accept a revoked token.
+def local_ttl():
+    if shared_token_cache() is None:
+        return cache_ttl()
+    return min(cache_ttl(), getattr(settings, 'AUTH_TOKEN_LOCAL_TTL', 5))
+
+
+# Returns the attnames of the user fields kept in the caches: the user's identity and flags, but never the password
+# hash, and not last_login, which logins change without invalidating the caches
+def user_fields():
+    return [field.attname for field in get_user_model()._meta.concrete_fields
+            if field.name not in ('password', 'last_login')]
+
+
+# Keys the shared cache by a hash of the token, so a reader of the cache cannot recover the token from its keys
+def shared_key(key):
+    return SHARED_KEY_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+
+
+# Drops cached tokens, e.g. when a token is deleted or its user is changed or deactivated
+def invalidate_tokens(keys):
+    keys = list(keys)
+    for key in keys:
+        token_cache.delete(key)
+    shared = shared_token_cache()
+    if shared is not None and keys:
+        shared.delete_many([shared_key(key) for key in keys])
+
+
+# TokenAuthentication that remembers the user of a checked token, so warm requests run no query at all. Entries hold
+# the fields of user_fields(), never the token or the password hash, and the user is rebuilt from them with the
+# password deferred. The Token and User signals in models.py drop the entries of the process that made the change
+# and of the shared cache (AUTH_TOKEN_SHARED_CACHE) if one is configured. Other processes keep their in-process
+# entries until they expire: after local_ttl() seconds, i.e. AUTH_TOKEN_CACHE_TTL without a shared cache and at most
+# AUTH_TOKEN_LOCAL_TTL with one.
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        entry = self.cached_entry(key)
+        if entry is None:
+            token = self.get_model().objects.select_related('user').filter(key=key).first()
+            if token is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            entry = self.entry_for(token.user)
+            self.remember(key, entry)
+        return self.authenticated(key, entry)
+
+    # Async counterpart of authenticate_credentials for the async views
+    async def aauthenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        shared = shared_token_cache()
+        if entry is None and shared is not None:
+            entry = await shared.aget(shared_key(key))
+            if entry is not None:
+                token_cache.set(key, entry)
+        if entry is None:
+            token = await self.get_model().objects.select_related('user').filter(key=key).afirst()
+            if token is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            entry = self.entry_for(token.user)
+            if shared is not None:
+                await shared.aset(shared_key(key), entry, cache_ttl())
+            token_cache.set(key, entry)
+        return self.authenticated(key, entry)
+
+    def cached_entry(self, key):
+        entry = token_cache.get(key)
+        shared = shared_token_cache()
+        if entry is None and shared is not None:
+            entry = shared.get(shared_key(key))
+            if entry is not None:
+                token_cache.set(key, entry)
+        return entry
+
+    def remember(self, key, entry):
+        shared = shared_token_cache()
+        if shared is not None:
+            shared.set(shared_key(key), entry, cache_ttl())
+        token_cache.set(key, entry)
+
+    @staticmethod
+    def entry_for(user):
+        return {name: getattr(user, name) for name in user_fields()}
+
+    # Rebuilds the user as if loaded from the database with its password and last_login deferred, and the (unsaved)
+    # token returned as request.auth
+    def authenticated(self, key, entry):
+        names = user_fields()
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, names, [entry[name] for name in names])
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        token = self.get_model()(key=key)
+        token.user = user
+        return user, token
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+from .models import HistoricalPerformance
+
+# Newest snapshots kept in memory for the subscribers at the head of the feed
+BUFFER_SIZE = 1000
+
+
+# Returns the seconds between the checks of the newest HistoricalPerformance id made for writes from other processes
+def poll_interval():
+    return getattr(settings, 'CHANGE_FEED_POLL_INTERVAL', 2)
+
+
+# Fans new HistoricalPerformance rows out to the subscribers of the change feed. Rows committed in this process are
+# announced by notify(); rows written by other processes (workers, management commands) are found by checking the
+# newest id at most once per poll_interval() for all subscribers together. New rows are read from the primary once
+# into a shared buffer that subscribers filter in memory, so an idle subscriber only holds a future and a new
+# snapshot costs one query per process however many subscribers there are. Subscribers resuming from a cursor older
+# than the buffer read their own rows until they catch up.
+class ChangeFeed:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetch_locks = weakref.WeakKeyDictionary()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.latest_id = 0
+            self.waiters = set()
+            self.polled_at = 0.0
+            # The buffer holds every snapshot with buffered_from < id <= buffered_to, in id order
+            self.buffer = []
+            self.buffered_from = self.buffered_to = None
+
+    # Records that rows up to latest_id exist and wakes every waiting subscriber. Safe to call from any thread.
+    def notify(self, latest_id):
+        with self.lock:
+            if latest_id <= self.latest_id:
+                return
+            self.latest_id = latest_id
+            waiters, self.waiters = self.waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self.wake, future, latest_id)
+
+    @staticmethod
+    def wake(future, latest_id):
+        if not future.done():
+            future.set_result(latest_id)
+
+    # Waits up to timeout seconds for rows newer than after_id and returns the newest id, or None on timeout
+    async def wait(self, after_id, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            future = loop.create_future()
+            with self.lock:
+                if self.latest_id > after_id:
+                    return self.latest_id
+                self.waiters.add((loop, future))
+            remaining = deadline - loop.time()
+            try:
+                return await asyncio.wait_for(future, min(remaining, poll_interval()))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.lock:
+                    self.waiters.discard((loop, future))
+            if remaining <= poll_interval():
+                return None
+            await self.poll()
+
+    # Reads the newest id from the primary if no subscriber did so within the poll interval
+    async def poll(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.polled_at < poll_interval():
+                return
+            self.polled_at = now
+        latest_id = await self.newest_id()
+        if latest_id is not None:
+            self.notify(latest_id)
+
+    @staticmethod
+    async def newest_id():
+        return (await HistoricalPerformance.objects.using(DEFAULT_DB_ALIAS).aaggregate(latest=Max('id')))['latest']
+
+    # Returns up to limit snapshots after the cursor, optionally of one vendor, in id order
+    async def rows_after(self, after_id, vendor_code=None, limit=100):
+        if self.buffered_to is None or self.buffered_to < self.latest_id:
+            await self.refill()
+        if after_id < self.buffered_from:
+            queryset = HistoricalPerformance.objects.using(DEFAULT_DB_ALIAS).filter(id__gt=after_id)
+            if vendor_code is not None:
+                queryset = queryset.filter(vendor_id=vendor_code)
+            return [row async for row in queryset.order_by('id')[:limit]]
+        rows = [row for row in self.buffer
+                if row.id > after_id and (vendor_code is None or row.vendor_id == vendor_code)]
+        return rows[:limit]
+
+    # Reads the rows added since the buffer was last filled. Subscribers woken together share one read.
+    async def refill(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            fetch_lock = self.fetch_locks.setdefault(loop, asyncio.Lock())
+        async with fetch_lock:
+            latest_id = self.latest_id
+            if self.buffered_to is None:
+                # Start empty at the newest row; older rows are read directly by the subscribers asking for them
+                start = await self.newest_id() or 0
+                with self.lock:
+                    self.buffered_from = self.buffered_to = start
+                self.notify(start)
+                return
+            if self.buffered_to >= latest_id:
+                return
+            buffered_from, buffered_to = self.buffered_from, self.buffered_to
+            # Only the newest BUFFER_SIZE new rows are read, so a burst such as a fleet-wide recompute costs one
+            # bounded query; subscribers behind them read the skipped rows directly
+            rows = [row async for row in HistoricalPerformance.objects.using(DEFAULT_DB_ALIAS)
+                    .filter(id__gt=buffered_to).order_by('-id')[:BUFFER_SIZE]][::-1]
+            if len(rows) == BUFFER_SIZE:
+                buffer = rows
+                buffered_from = rows[0].id - 1
+            else:
+                buffer = self.buffer + rows
+                if len(buffer) > BUFFER_SIZE:
+                    buffered_from = buffer[-BUFFER_SIZE - 1].id
+                    buffer = buffer[-BUFFER_SIZE:]
+            if rows:
+                buffered_to = rows[-1].id
+            with self.lock:
+                self.buffer = buffer
+                self.buffered_from = buffered_from
+                # Rows up to the announced id were committed before the read, so they are in it
+                self.buffered_to = max(buffered_to, latest_id)
+
+
+change_feed = ChangeFeed()
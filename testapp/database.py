@@ -0,0 +1,82 @@
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Models whose reads always go to the replica when one is configured
+REPLICA_MODELS = {'testapp.historicalperformance', 'testapp.performancerollup'}
+
+# Whether the current request (or command) has written to the primary database, so its later reads must see it
+_wrote_primary = contextvars.ContextVar('wrote_primary', default=False)
+
+
+# Returns the alias of the read replica named by the REPLICA_DATABASE setting, or None if it is not configured
+def replica_alias():
+    alias = getattr(settings, 'REPLICA_DATABASE', 'replica')
+    return alias if alias in connections.settings else None
+
+
+# Returns the alias reads may use: the replica, unless there is none, the current request already wrote to the
+# primary (read-your-writes), or a transaction is open on the primary
+def read_alias():
+    alias = replica_alias()
+    if alias is None or _wrote_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+# Sends every write to the primary and history reads to the replica. List and export endpoints opt in to the
+# replica for their other models with QuerySet.using(read_alias()).
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in REPLICA_MODELS:
+            return read_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        _wrote_primary.set(True)
+        return DEFAULT_DB_ALIAS
+
+    # The replica is a copy of the primary, so objects from either may be related
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+# Scopes read-your-writes stickiness to a request: reads go back to the replica once the request that wrote ends
+class ReadYourWritesMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _wrote_primary.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _wrote_primary.reset(token)
+
+    async def __acall__(self, request):
+        token = _wrote_primary.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            _wrote_primary.reset(token)
+
+
+# Applies the SQLITE_PRAGMAS setting (e.g. WAL journaling and a busy timeout) to every new SQLite connection
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
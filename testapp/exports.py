@@ -0,0 +1,60 @@
+import csv
+import datetime
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+# Rows fetched per database round trip and rows written per streamed chunk
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_ROWS = 500
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+_datetime_field = serializers.DateTimeField()
+
+
+# Pseudo-buffer for csv.writer that hands back each formatted line instead of storing it
+class _Echo:
+    def write(self, value):
+        return value
+
+
+# Formats a value the way the JSON API does, so exports and list responses agree
+def _export_value(value, export_format):
+    if isinstance(value, datetime.datetime):
+        return _datetime_field.to_representation(value)
+    if export_format == 'csv' and isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+# Yields the export in buffered chunks while reading the queryset with a server-side iterator
+def _stream_rows(queryset, columns, fields, export_format):
+    rows = queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    writer = csv.writer(_Echo())
+    buffer = [writer.writerow(columns)] if export_format == 'csv' else []
+    for row in rows:
+        values = [_export_value(value, export_format) for value in row]
+        if export_format == 'csv':
+            buffer.append(writer.writerow(values))
+        else:
+            buffer.append(json.dumps(dict(zip(columns, values))) + '\n')
+        if len(buffer) >= EXPORT_BUFFER_ROWS:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+# Streams a queryset as CSV or NDJSON with constant memory. `columns` maps output column names to model fields.
+def stream_export(queryset, columns, export_format, filename):
+    response = StreamingHttpResponse(
+        _stream_rows(queryset, list(columns), list(columns.values()), export_format),
+        content_type=CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,91 @@
+import functools
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+
+# Returns a converter that renders a timezone-aware datetime as the given DRF DateTimeField does
+def _datetime_converter(field):
+    timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+# Returns the converter of one serializer field: None when the column value is already its representation,
+# the field's own to_representation for simple fields without a faster equivalent, and False when the field cannot
+# be rendered from its column alone (nested, dotted or method fields)
+def _field_converter(field):
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        return None if field.pk_field is None else field.pk_field.to_representation
+    if isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField, serializers.BaseSerializer,
+                          serializers.SerializerMethodField, serializers.HiddenField)):
+        return False
+    if isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is not None and output_format.lower() == ISO_8601:
+            return _datetime_converter
+        return field.to_representation
+    if isinstance(field, serializers.JSONField):
+        return field.to_representation if field.binary else None
+    if type(field) is serializers.FloatField:
+        return float
+    if type(field) is serializers.IntegerField:
+        return int
+    if type(field) is serializers.CharField:
+        return str
+    return field.to_representation
+
+
+# Renders rows fetched with QuerySet.values(*columns) to the same representation as the model serializer, with
+# one precompiled converter per field instead of the serializer's per-row field machinery
+class RowConverter:
+    def __init__(self, fields):
+        # (output name, column, converter or None, field)
+        self.fields = fields
+        self.columns = [column for _, column, _, _ in fields]
+
+    # Builds the converter of a ModelSerializer class, or returns None if one of its fields is not a plain column
+    @classmethod
+    def for_serializer(cls, serializer_class):
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            converter = _field_converter(field)
+            if converter is False or '.' in field.source or field.source == '*':
+                return None
+            try:
+                column = model._meta.get_field(field.source).attname
+            except FieldDoesNotExist:
+                return None
+            fields.append((name, column, converter, field))
+        return cls(fields)
+
+    # Converts the rows; datetime converters are bound here, as the current timezone may differ per request
+    def convert(self, rows):
+        steps = [(name, column, converter(field) if converter is _datetime_converter else converter)
+                 for name, column, converter, field in self.fields]
+        results = []
+        for row in rows:
+            item = {}
+            for name, column, converter in steps:
+                value = row[column]
+                item[name] = value if value is None or converter is None else converter(value)
+            results.append(item)
+        return results
+
+
+# Returns the cached RowConverter of a serializer class (None if it has no fast path)
+@functools.lru_cache(maxsize=None)
+def row_converter(serializer_class):
+    return RowConverter.for_serializer(serializer_class)
@@ -0,0 +1,219 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('testapp.requests')
+
+# Upper bounds (in seconds, or queries for the query histogram) of the histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Statistics of the request being handled, so instrumented model methods can attribute their time to its view
+_current_request = contextvars.ContextVar('current_request_stats', default=None)
+
+
+# A cumulative Prometheus histogram per label set
+class Histogram:
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts, total = self.series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-1] += 1
+        self.series[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.series.items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {counts[-1]}')
+        return lines
+
+
+# A Prometheus counter per label set
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels):
+        self.series[labels] = self.series.get(labels, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# In-process store of every request metric, guarded by a lock because requests run on many threads
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter('http_requests_total', 'Requests handled, by view and status code.',
+                                ('view', 'status'))
+        self.durations = Histogram('http_request_duration_seconds', 'Wall time of each request.',
+                                   DURATION_BUCKETS, ('view',))
+        self.queries = Histogram('db_queries_per_request', 'Database queries issued by each request.',
+                                 QUERY_BUCKETS, ('view',))
+        self.db_time = Histogram('db_time_per_request_seconds', 'Time spent in the database by each request.',
+                                 DURATION_BUCKETS, ('view',))
+        self.vendor_updates = Histogram('vendor_update_duration_seconds',
+                                        'Time spent in each Vendor metric update method call.',
+                                        DURATION_BUCKETS, ('view', 'method'))
+
+    def record_request(self, stats, status_code, duration):
+        with self.lock:
+            self.requests.inc((stats.view, str(status_code)))
+            self.durations.observe((stats.view,), duration)
+            self.queries.observe((stats.view,), stats.query_count)
+            self.db_time.observe((stats.view,), stats.db_time)
+
+    def record_vendor_update(self, view, method, duration):
+        with self.lock:
+            self.vendor_updates.observe((view, method), duration)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.durations, self.queries, self.db_time, self.vendor_updates):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+# Database activity of one request, collected through connection execute wrappers
+class RequestStats:
+    def __init__(self, keep_sql):
+        self.view = 'unresolved'
+        self.query_count = 0
+        self.db_time = 0.0
+        self.statements = [] if keep_sql else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.query_count += 1
+            self.db_time += elapsed
+            if self.statements is not None:
+                self.statements.append((elapsed, sql))
+
+
+# Names a view after its class and viewset action, e.g. PurchaseOrderViewSet.complete
+def view_label(view_func, method):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    return f'{view_class.__name__}.{action}' if action else view_class.__name__
+
+
+# Records wall time, query count and database time per view, and logs requests slower than
+# SLOW_REQUEST_THRESHOLD_MS together with their slowest SQL statements. Under ASGI the async views' queries run
+# in the request's sync_to_async thread, whose connections differ from the event loop's, so the wrappers are
+# installed there.
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats(keep_sql=self.slow_threshold() is not None)
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.install(stack, stats)
+                response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(keep_sql=self.slow_threshold() is not None)
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        stack = ExitStack()
+        try:
+            await sync_to_async(self.install)(stack, stats)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current_request.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def slow_threshold(self):
+        return getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None)
+
+    def install(self, stack, stats):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+
+    def record(self, request, response, stats, duration):
+        registry.record_request(stats, response.status_code, duration)
+        threshold = self.slow_threshold()
+        if threshold is not None and duration * 1000 >= threshold:
+            slowest = sorted(stats.statements, key=lambda statement: statement[0], reverse=True)[:5]
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms in the database. Slowest SQL:\n%s',
+                request.method, request.path, stats.view, duration * 1000, stats.query_count, stats.db_time * 1000,
+                '\n'.join(f'  {elapsed * 1000:.1f} ms: {sql}' for elapsed, sql in slowest))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = _current_request.get()
+        if stats is not None:
+            stats.view = view_label(view_func, request.method)
+
+
+# Decorator recording the time spent in a Vendor metric update method under the current request's view
+def timed_vendor_update(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats = _current_request.get()
+            registry.record_vendor_update(stats.view if stats else 'background', method.__name__,
+                                          time.perf_counter() - started)
+    return wrapper
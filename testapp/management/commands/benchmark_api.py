@@ -0,0 +1,185 @@
+import json
+import math
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from testapp.models import Vendor, PurchaseOrder, PurchaseOrderItem
+
+
+# Returns the nearest-rank percentile of a sorted list
+def percentile(values, fraction):
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+# Summarises the latencies (in milliseconds) of requests that took elapsed seconds in total
+def summarise(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+    }
+
+
+# Generates synthetic vendors and purchase orders, then benchmarks the hot API paths through the test client.
+class Command(BaseCommand):
+    help = "Generate N vendors and M purchase orders and report latency percentiles, throughput and queries per " \
+           "request of the main API endpoints as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendors', type=int, default=50, help="Vendors to generate (default: 50).")
+        parser.add_argument('--orders', type=int, default=5000, help="Purchase orders to generate (default: 5000).")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario (default: 200).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable data sets.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument('--in-place', action='store_true',
+                            help="Use the configured database instead of a throwaway test database. "
+                                 "The generated data is left behind.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        # Prefixes the generated vendor codes, po_numbers and user, so repeated --in-place runs do not collide
+        self.run_id = uuid.uuid4().hex[:8]
+        if options['in_place']:
+            # The test environment, which allows the test client's host, is only set up for a throwaway database
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                report = self.run(options)
+        else:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                report = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        started = time.perf_counter()
+        vendor_codes = self.generate_vendors(options['vendors'])
+        self.generate_orders(vendor_codes, options['orders'])
+        setup_seconds = time.perf_counter() - started
+
+        user = User.objects.create_user(f'benchmark-{self.run_id}')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+
+        count = options['requests']
+        # Only this run's orders are acknowledged and completed, so --in-place leaves existing orders alone
+        generated = PurchaseOrder.objects.filter(vendor__in=vendor_codes)
+        pending = list(generated.filter(acknowledgment_date__isnull=True)
+                       .values_list('po_number', flat=True)[:count])
+        open_orders = list(generated.exclude(status='Complete')
+                           .values_list('po_number', flat=True)[:count])
+        # Vendor deletion gets its own small vendors so the other scenarios keep their data
+        doomed = self.generate_vendors(min(count, 20), prefix='DEL')
+        self.generate_orders(doomed, len(doomed) * max(1, options['orders'] // max(1, options['vendors'])))
+
+        scenarios = {
+            'po_create': [('post', '/api/purchase_orders/',
+                           self.order_payload(f'{self.run_id}BENCH{number:08d}', vendor_codes))
+                          for number in range(count)],
+            'acknowledge': [('post', f'/api/purchase_orders/{po}/acknowledge/', None) for po in pending],
+            'complete': [('post', f'/api/purchase_orders/{po}/complete/', None) for po in open_orders],
+            'performance': [('get', f'/api/vendors/{self.random.choice(vendor_codes)}/performance/', None)
+                            for _ in range(count)],
+            'list_purchase_orders': [
+                ('get', f'/api/purchase_orders/?vendor__vendor_code={self.random.choice(vendor_codes)}', None)
+                for _ in range(count)],
+            'list_historical_performance': [
+                ('get', f'/api/historical_performance/?vendor__vendor_code={self.random.choice(vendor_codes)}', None)
+                for _ in range(count)],
+            'vendor_delete': [('delete', f'/api/vendors/{code}/', None) for code in doomed],
+        }
+        return {
+            'config': {name: options[name] for name in ('vendors', 'orders', 'requests', 'seed')},
+            'database': connection.vendor,
+            'setup_seconds': round(setup_seconds, 3),
+            'scenarios': {name: self.measure(requests) for name, requests in scenarios.items()},
+        }
+
+    # Runs the requests of one scenario and summarises latency, throughput and query counts
+    def measure(self, requests):
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for method, url, payload in requests:
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = getattr(self.client, method)(url, payload, format='json')
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+            if response.streaming:
+                b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        if not latencies:
+            return {'requests': 0}
+        return dict(summarise(latencies, errors, elapsed), queries_per_request=round(statistics.fmean(queries), 2),
+                    max_queries=max(queries))
+
+    def generate_vendors(self, count, prefix='V'):
+        vendors = [Vendor(vendor_code=f'{self.run_id}{prefix}{number:06d}', name=f'Vendor {number}',
+                          contact_details=f'+91{self.random.randrange(10 ** 9, 10 ** 10)}', address=f'Plot {number}')
+                   for number in range(count)]
+        Vendor.objects.bulk_create(vendors)
+        return [vendor.vendor_code for vendor in vendors]
+
+    # Creates orders with a realistic mix of pending, acknowledged and completed ones, then computes the metrics.
+    # Their po_numbers start with the vendor codes' run and group prefix (the codes without their six digits).
+    def generate_orders(self, vendor_codes, count):
+        now = timezone.now()
+        orders = []
+        for number in range(count):
+            order_date = now - timedelta(days=self.random.uniform(1, 365))
+            expected = order_date + timedelta(days=self.random.uniform(3, 14))
+            fields = {'acknowledgment_date': None, 'final_delivery_date': None, 'quality_rating': None,
+                      'status': 'pending'}
+            roll = self.random.random()
+            if roll < 0.8:
+                fields['acknowledgment_date'] = order_date + timedelta(hours=self.random.expovariate(1 / 12))
+            if roll < 0.6:
+                fields['status'] = 'Complete'
+                fields['final_delivery_date'] = expected + timedelta(days=self.random.gauss(-0.5, 2))
+                if self.random.random() < 0.85:
+                    fields['quality_rating'] = float(self.random.choices([1, 2, 3, 4, 5], [1, 2, 4, 8, 6])[0])
+            orders.append(PurchaseOrder(
+                po_number=f'{vendor_codes[0][:-6]}PO{number:09d}', vendor_id=self.random.choice(vendor_codes),
+                items=[{'sku': f'SKU{self.random.randrange(500):04d}', 'qty': self.random.randint(1, 20)}],
+                quantity=self.random.randint(1, 100), order_date=order_date, expected_delivery_date=expected,
+                issue_date=order_date, **fields))
+        PurchaseOrder.objects.bulk_create(orders, batch_size=500)
+        PurchaseOrderItem.sync(orders, replace=False)
+        for vendor in Vendor.objects.filter(pk__in=vendor_codes):
+            vendor.refresh_metrics()
+
+    def order_payload(self, po_number, vendor_codes):
+        now = timezone.now()
+        return {
+            'po_number': po_number, 'vendor': self.random.choice(vendor_codes),
+            'items': [{'sku': f'SKU{self.random.randrange(500):04d}', 'qty': 1}], 'quantity': 1,
+            'order_date': now.isoformat(), 'expected_delivery_date': (now + timedelta(days=7)).isoformat(),
+            'issue_date': now.isoformat(),
+        }
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from testapp.management.commands.benchmark_api import Command as BenchmarkCommand, summarise
+
+# Read endpoints served both by the DRF viewsets and by testapp.async_views, as {name: path below /api/}
+ENDPOINTS = {
+    'vendor_detail': 'vendors/{vendor}/',
+    'performance': 'vendors/{vendor}/performance/',
+    'list_purchase_orders': 'purchase_orders/?vendor__vendor_code={vendor}',
+    'list_historical_performance': 'historical_performance/?vendor__vendor_code={vendor}',
+}
+
+
+# Sends one GET request straight to an ASGI application, the way an ASGI server such as uvicorn would, and
+# returns the response status
+async def asgi_get(application, url, headers):
+    path, _, query_string = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost')] + [(name.lower().encode(), value.encode())
+                                                for name, value in headers.items()],
+        'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 8000),
+    }
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    try:
+        await application(scope, receive, send)
+    finally:
+        finished.set()
+    return status
+
+
+# Compares the sync DRF read endpoints with their async versions under concurrent load on the ASGI application.
+class Command(BenchmarkCommand):
+    help = "Generate N vendors and M purchase orders, then load the sync and async read endpoints through the " \
+           "ASGI application at several concurrency levels and report latency percentiles, throughput and the " \
+           "peak number of threads as JSON."
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--concurrency', default='1,10,50',
+                            help="Comma separated numbers of requests kept in flight (default: 1,10,50).")
+
+    def run(self, options):
+        started = time.perf_counter()
+        vendor_codes = self.generate_vendors(options['vendors'])
+        self.generate_orders(vendor_codes, options['orders'])
+        setup_seconds = time.perf_counter() - started
+
+        user = User.objects.create_user(f'benchmark-{self.run_id}')
+        headers = {'Authorization': f'Token {Token.objects.get(user=user).key}'}
+        levels = [int(level) for level in options['concurrency'].split(',') if level]
+        application = get_asgi_application()
+
+        endpoints = {}
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            for name, path in ENDPOINTS.items():
+                paths = [path.format(vendor=self.random.choice(vendor_codes)) for _ in range(options['requests'])]
+                endpoints[name] = {
+                    mode: {
+                        str(level): asyncio.run(self.load(application, [prefix + path for path in paths], level,
+                                                          headers))
+                        for level in levels
+                    }
+                    for mode, prefix in (('sync', '/api/'), ('async', '/api/async/'))
+                }
+        return {
+            'config': dict({name: options[name] for name in ('vendors', 'orders', 'requests', 'seed')},
+                           concurrency=levels),
+            'database': connection.vendor,
+            'setup_seconds': round(setup_seconds, 3),
+            'endpoints': endpoints,
+        }
+
+    # Sends the requests with at most `concurrency` of them in flight and summarises them
+    async def load(self, application, urls, concurrency, headers):
+        latencies, errors, peak_threads = [], 0, threading.active_count()
+        pending = iter(urls)
+
+        async def client():
+            nonlocal errors, peak_threads
+            for url in pending:
+                request_started = time.perf_counter()
+                status = await asgi_get(application, url, headers)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+                errors += status >= 400
+                peak_threads = max(peak_threads, threading.active_count())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        if not latencies:
+            return {'requests': 0}
+        return dict(summarise(latencies, errors, time.perf_counter() - started), peak_threads=peak_threads)
@@ -0,0 +1,109 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from testapp.management.commands.benchmark_api import Command as BenchmarkCommand, summarise
+from testapp.models import HistoricalPerformance
+
+# List endpoints with a fast serialization path, as {name: path below /api/}
+ENDPOINTS = {
+    'list_vendors': 'vendors/',
+    'list_purchase_orders': 'purchase_orders/',
+    'list_historical_performance': 'historical_performance/',
+}
+
+
+# Compares the list endpoints served from model instances and serializers with their fast path from
+# QuerySet.values() rows, on full pages of the largest allowed size.
+class Command(BenchmarkCommand):
+    help = "Generate N vendors, M purchase orders and H historical performance snapshots, then fetch full pages " \
+           "of the list endpoints with and without FAST_LIST_SERIALIZATION and report latency percentiles, rows " \
+           "per second, the speedup and whether both responses are identical as JSON."
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--history', type=int, default=50000,
+                            help="Historical performance snapshots to generate (default: 50000).")
+        parser.add_argument('--page-size', type=int, default=1000, help="Rows per page (default: 1000).")
+        parser.set_defaults(vendors=1000, requests=20)
+
+    def run(self, options):
+        started = time.perf_counter()
+        vendor_codes = self.generate_vendors(options['vendors'])
+        self.generate_orders(vendor_codes, options['orders'])
+        self.generate_history(vendor_codes, options['history'])
+        setup_seconds = time.perf_counter() - started
+
+        user = User.objects.create_user(f'benchmark-{self.run_id}')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+
+        endpoints = {}
+        for name, path in ENDPOINTS.items():
+            url = f'/api/{path}?page_size={options["page_size"]}'
+            with override_settings(FAST_LIST_SERIALIZATION=False):
+                serializer = self.measure_list(url, options['requests'])
+            fast = self.measure_list(url, options['requests'])
+            # Error pages would be compared and timed instead of the lists
+            for mode, result in (('serializer', serializer), ('fast', fast)):
+                if result['summary']['errors']:
+                    raise CommandError(f"{name} ({mode}): {result['summary']['errors']} of {options['requests']} "
+                                       f"request(s) failed, the last with HTTP {result['status']}.")
+            endpoints[name] = {
+                'rows_per_page': fast.pop('rows'),
+                'serializer': dict(serializer.pop('summary'), rows_per_second=serializer['rows_per_second']),
+                'fast': dict(fast.pop('summary'), rows_per_second=fast['rows_per_second']),
+                'speedup': round(serializer['mean_ms'] / fast['mean_ms'], 2),
+                'identical': serializer['content'] == fast['content'],
+            }
+        return {
+            'config': {name: options[name] for name in ('vendors', 'orders', 'history', 'page_size', 'requests',
+                                                        'seed')},
+            'database': connection.vendor,
+            'setup_seconds': round(setup_seconds, 3),
+            'endpoints': endpoints,
+        }
+
+    # Fetches the first page of a list endpoint count times and summarises latency and rows per second
+    def measure_list(self, url, count):
+        latencies, errors, content, status = [], 0, None, None
+        started = time.perf_counter()
+        for _ in range(count):
+            request_started = time.perf_counter()
+            response = self.client.get(url)
+            latencies.append((time.perf_counter() - request_started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+                status = response.status_code
+            content = response.content
+        elapsed = time.perf_counter() - started
+        data = response.json() if not errors else []
+        # The vendor list is not paginated
+        rows = len(data['results'] if isinstance(data, dict) else data)
+        mean_ms = statistics.fmean(latencies)
+        return {
+            'summary': summarise(latencies, errors, elapsed),
+            'rows': rows,
+            'mean_ms': mean_ms,
+            'rows_per_second': round(rows * 1000 / mean_ms, 1),
+            'content': content,
+            'status': status,
+        }
+
+    # Adds count snapshots spread over the past year across the vendors
+    def generate_history(self, vendor_codes, count):
+        now = timezone.now()
+        HistoricalPerformance.objects.bulk_create([
+            HistoricalPerformance(
+                vendor_id=self.random.choice(vendor_codes),
+                date=now - timedelta(minutes=self.random.uniform(0, 525600)),
+                on_time_delivery_rate=self.random.random(), quality_rating_avg=self.random.uniform(1, 5),
+                average_response_time=self.random.expovariate(1 / 43200), fulfillment_rate=self.random.random())
+            for _ in range(count)], batch_size=1000)
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from testapp.models import HistoricalPerformance
+from testapp.rollups import RESOLUTIONS, store_rollups
+
+
+# Compacts raw HistoricalPerformance snapshots older than the retention window into the rollup buckets.
+class Command(BaseCommand):
+    help = "Roll raw historical performance snapshots older than the retention window into hourly, daily and " \
+           "monthly buckets, then delete them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=30,
+                            help="Keep raw snapshots newer than this many days (default: 30).")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many snapshots would be compacted.")
+
+    def handle(self, *args, **options):
+        # Align the cutoff to a local hour so that every compacted hourly bucket is complete
+        cutoff = timezone.localtime(timezone.now() - timedelta(days=options['retention_days']))
+        cutoff = cutoff.replace(minute=0, second=0, microsecond=0)
+        snapshots = HistoricalPerformance.objects.filter(date__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{snapshots.count()} snapshot(s) older than {cutoff.isoformat()} would be compacted.")
+            return
+
+        with transaction.atomic():
+            # Fix the compacted set by id so snapshots recorded meanwhile are neither rolled up nor deleted
+            last_id = snapshots.order_by('-id').values_list('id', flat=True).first()
+            if last_id is None:
+                self.stdout.write("No snapshots to compact.")
+                return
+            snapshots = snapshots.filter(id__lte=last_id)
+            buckets = {resolution: store_rollups(snapshots, resolution) for resolution in RESOLUTIONS}
+            deleted, _ = snapshots.delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {deleted} snapshot(s) older than {cutoff.isoformat()} into "
+            + ", ".join(f"{count} {resolution}" for resolution, count in buckets.items()) + " bucket(s)."))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from testapp.models import DirtyVendor
+
+
+# Drains the persisted dirty-vendor queue filled when VENDOR_METRICS_MODE is 'queue'.
+class Command(BaseCommand):
+    help = "Recompute the metrics of every vendor marked dirty, once per vendor."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit instead of polling.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to wait between polls.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Vendors claimed per batch.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.drain(options['batch_size'])
+            if processed:
+                self.stdout.write(f"Recomputed metrics for {processed} vendor(s).")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    # Recomputes queued vendors in batches until the queue is empty and returns how many were processed
+    def drain(self, batch_size):
+        processed = 0
+        while True:
+            marks = list(DirtyVendor.objects.select_related('vendor').order_by('marked_at')[:batch_size])
+            if not marks:
+                return processed
+            for mark in marks:
+                # The mark is removed before recomputing, so a change committed meanwhile marks the vendor again
+                with transaction.atomic():
+                    if DirtyVendor.objects.filter(pk=mark.pk).delete()[0]:
+                        mark.vendor.refresh_metrics()
+                        processed += 1
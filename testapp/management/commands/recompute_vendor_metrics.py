@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from testapp.models import Vendor, PurchaseOrder, HistoricalPerformance, VendorMetricAccumulator, VendorRanking
+from testapp.performance_cache import invalidate_performance
+from testapp.change_feed import change_feed
+
+
+# Recomputes every vendor's metrics from its purchase orders with one GROUP BY vendor query per vendor range.
+class Command(BaseCommand):
+    help = "Recompute all vendor metrics and accumulators in bulk, writing only vendors whose values changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per bulk_update/bulk_create batch.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Split the vendors into this many code ranges and recompute them in parallel.")
+        parser.add_argument('--from', dest='code_from', help="Only vendors whose code is >= this value.")
+        parser.add_argument('--to', dest='code_to', help="Only vendors whose code is < this value.")
+        parser.add_argument('--rankings', action='store_true',
+                            help="Rebuild the ranking rows of every vendor, not only of those that changed.")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing.")
+
+    def handle(self, *args, **options):
+        # SQLite allows one writer at a time, so parallel ranges would fail with "database is locked"
+        if options['workers'] > 1 and connection.vendor == 'sqlite':
+            raise CommandError("--workers > 1 needs a database with concurrent writers; SQLite allows only one.")
+        ranges = self.split_ranges(options['code_from'], options['code_to'], max(1, options['workers']))
+        params = (options['batch_size'], options['rankings'], options['dry_run'])
+        if len(ranges) == 1:
+            results = [self.recompute_range(*ranges[0], *params)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                results = list(executor.map(lambda bounds: self.recompute_in_thread(*bounds, *params), ranges))
+
+        vendors, changed, accumulators = (sum(result[index] for result in results) for index in range(3))
+        prefix = "Would update" if options['dry_run'] else "Updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {vendors} vendor(s). {prefix} metrics of {changed} vendor(s) "
+            f"and {accumulators} accumulator(s)."))
+
+    # Splits [code_from, code_to) into contiguous code ranges holding about the same number of vendors
+    def split_ranges(self, code_from, code_to, workers):
+        if workers == 1:
+            return [(code_from, code_to)]
+        codes = list(self.vendors_in(code_from, code_to).values_list('pk', flat=True))
+        step = max(1, -(-len(codes) // workers))
+        boundaries = codes[step::step]
+        return list(zip([code_from] + boundaries, boundaries + [code_to]))
+
+    # Returns lookups restricting a vendor code field to [code_from, code_to)
+    def code_range(self, field, code_from, code_to):
+        lookups = {}
+        if code_from is not None:
+            lookups[f'{field}__gte'] = code_from
+        if code_to is not None:
+            lookups[f'{field}__lt'] = code_to
+        return lookups
+
+    def vendors_in(self, code_from, code_to):
+        return Vendor.objects.filter(**self.code_range('pk', code_from, code_to)).order_by('pk')
+
+    def recompute_in_thread(self, *args):
+        try:
+            return self.recompute_range(*args)
+        finally:
+            # Each worker thread opened its own connection
+            connection.close()
+
+    # Recomputes one vendor range and returns (vendors seen, vendors changed, accumulators rewritten)
+    def recompute_range(self, code_from, code_to, batch_size, all_rankings, dry_run):
+        vendors = self.vendors_in(code_from, code_to)
+        rows = PurchaseOrder.objects.filter(**self.code_range('vendor_id', code_from, code_to)).order_by() \
+            .values('vendor_id').annotate(**VendorMetricAccumulator.counter_aggregates())
+        counters = {row['vendor_id']: VendorMetricAccumulator.normalize_counters(row) for row in rows}
+        stored = {accumulator.pk: accumulator for accumulator in VendorMetricAccumulator.objects.filter(
+            **self.code_range('vendor_id', code_from, code_to))}
+        zeros = VendorMetricAccumulator.normalize_counters({})
+
+        now = timezone.now()
+        seen = 0
+        changed_vendors, snapshots, new_accumulators, changed_accumulators, ranked = [], [], [], [], []
+        for vendor in vendors.only('pk', *Vendor.METRIC_FIELDS).iterator(chunk_size=batch_size):
+            seen += 1
+            if all_rankings:
+                ranked.append(vendor)
+            vendor_counters = counters.get(vendor.pk, zeros)
+            metrics = VendorMetricAccumulator.derive_metrics(vendor_counters)
+            if any(metrics[name] != getattr(vendor, name) for name in Vendor.METRIC_FIELDS):
+                for name, value in metrics.items():
+                    setattr(vendor, name, value)
+                changed_vendors.append(vendor)
+                snapshots.append(HistoricalPerformance(vendor_id=vendor.pk, date=now, **metrics))
+            accumulator = stored.get(vendor.pk)
+            if accumulator is None:
+                new_accumulators.append(VendorMetricAccumulator(vendor_id=vendor.pk, **vendor_counters))
+            elif any(getattr(accumulator, name) != value for name, value in vendor_counters.items()):
+                for name, value in vendor_counters.items():
+                    setattr(accumulator, name, value)
+                changed_accumulators.append(accumulator)
+
+        if not dry_run:
+            with transaction.atomic():
+                Vendor.objects.bulk_update(changed_vendors, Vendor.METRIC_FIELDS, batch_size=batch_size)
+                HistoricalPerformance.objects.bulk_create(snapshots, batch_size=batch_size)
+                VendorMetricAccumulator.objects.bulk_create(new_accumulators, batch_size=batch_size)
+                VendorMetricAccumulator.objects.bulk_update(
+                    changed_accumulators, VendorMetricAccumulator.COUNTER_FIELDS, batch_size=batch_size)
+                # bulk_update and bulk_create send no signals, so rankings and cached performance entries are
+                # refreshed here and the new snapshots are announced to the change feed
+                VendorRanking.refresh(ranked if all_rankings else changed_vendors)
+                changed_codes = [vendor.pk for vendor in changed_vendors]
+                # Backends that return no ids on bulk_create leave the snapshots to the feed's poll
+                latest_id = max((snapshot.pk for snapshot in snapshots if snapshot.pk is not None), default=None)
+                transaction.on_commit(lambda: self.announce(changed_codes, latest_id))
+        return seen, len(changed_vendors), len(new_accumulators) + len(changed_accumulators)
+
+    @staticmethod
+    def announce(vendor_codes, latest_id):
+        invalidate_performance(vendor_codes)
+        if latest_id is not None:
+            change_feed.notify(latest_id)
@@ -0,0 +1,46 @@
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+from testapp.models import Vendor, VendorMetricAccumulator
+
+
+# Compares every vendor's running accumulator against a full recount of its purchase orders.
+class Command(BaseCommand):
+    help = "Verify the incremental vendor metric accumulators against a full recompute."
+
+    def add_arguments(self, parser):
+        parser.add_argument('vendor_codes', nargs='*', help="Only verify these vendors (default: all vendors).")
+        parser.add_argument('--fix', action='store_true',
+                            help="Rebuild mismatched accumulators and store the recomputed metrics.")
+
+    def handle(self, *args, **options):
+        vendors = Vendor.objects.all()
+        if options['vendor_codes']:
+            vendors = vendors.filter(vendor_code__in=options['vendor_codes'])
+        accumulators = VendorMetricAccumulator.objects.in_bulk(vendors.values_list('pk', flat=True))
+
+        mismatched = []
+        for vendor in vendors.iterator():
+            expected = VendorMetricAccumulator.recount(vendor)
+            accumulator = accumulators.get(vendor.pk)
+            if accumulator is None:
+                differences = ['accumulator missing']
+            else:
+                differences = [
+                    f"{name}: stored {getattr(accumulator, name)}, expected {value}"
+                    for name, value in expected.items()
+                    if not math.isclose(getattr(accumulator, name), value, rel_tol=1e-9, abs_tol=1e-9)
+                ]
+            if not differences:
+                continue
+            mismatched.append(vendor.pk)
+            self.stdout.write(f"{vendor.pk}: " + "; ".join(differences))
+            if options['fix']:
+                vendor.refresh_metrics()
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS("All vendor metric accumulators match."))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(mismatched)} vendor metric accumulator(s)."))
+        else:
+            raise CommandError(f"{len(mismatched)} vendor metric accumulator(s) differ from a full recompute.")
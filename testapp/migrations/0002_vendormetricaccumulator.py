@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:42
+
+import django.db.models.deletion
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, Q, Sum
+
+
+def build_accumulators(apps, schema_editor):
+    Vendor = apps.get_model('testapp', 'Vendor')
+    VendorMetricAccumulator = apps.get_model('testapp', 'VendorMetricAccumulator')
+    alias = schema_editor.connection.alias
+    completed = Q(status='Complete')
+    for vendor in Vendor.objects.using(alias).all().iterator():
+        counters = vendor.purchase_orders.using(alias).aggregate(
+            total_orders=Count('pk'),
+            completed_orders=Count('pk', filter=completed),
+            on_time_orders=Count('pk', filter=completed & Q(final_delivery_date__lte=F('expected_delivery_date'))),
+            rated_orders=Count('pk', filter=Q(quality_rating__isnull=False)),
+            quality_rating_sum=Sum('quality_rating'),
+            fulfilled_orders=Count('pk', filter=completed & Q(quality_rating__isnull=False)),
+            acknowledged_orders=Count('pk', filter=Q(acknowledgment_date__isnull=False)),
+            response_time_sum=Sum(ExpressionWrapper(F('acknowledgment_date') - F('issue_date'),
+                                                    output_field=models.DurationField())),
+        )
+        counters['quality_rating_sum'] = counters['quality_rating_sum'] or 0.0
+        response_time = counters['response_time_sum']
+        counters['response_time_sum'] = response_time // timedelta(microseconds=1) if response_time else 0
+        VendorMetricAccumulator.objects.using(alias).create(vendor=vendor, **counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorMetricAccumulator',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metric_accumulator', serialize=False, to='testapp.vendor')),
+                ('total_orders', models.BigIntegerField(default=0)),
+                ('completed_orders', models.BigIntegerField(default=0)),
+                ('on_time_orders', models.BigIntegerField(default=0)),
+                ('rated_orders', models.BigIntegerField(default=0)),
+                ('quality_rating_sum', models.FloatField(default=0.0)),
+                ('fulfilled_orders', models.BigIntegerField(default=0)),
+                ('acknowledged_orders', models.BigIntegerField(default=0)),
+                ('response_time_sum', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_accumulators, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0002_vendormetricaccumulator'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyVendor',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dirty_mark', serialize=False, to='testapp.vendor')),
+                ('marked_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
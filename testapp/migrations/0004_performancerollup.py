@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0003_dirtyvendor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerformanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('bucket_start', models.DateTimeField()),
+                ('samples', models.IntegerField()),
+                ('last_at', models.DateTimeField()),
+                ('on_time_delivery_rate_min', models.FloatField()),
+                ('on_time_delivery_rate_max', models.FloatField()),
+                ('on_time_delivery_rate_avg', models.FloatField()),
+                ('on_time_delivery_rate_last', models.FloatField()),
+                ('quality_rating_avg_min', models.FloatField()),
+                ('quality_rating_avg_max', models.FloatField()),
+                ('quality_rating_avg_avg', models.FloatField()),
+                ('quality_rating_avg_last', models.FloatField()),
+                ('average_response_time_min', models.FloatField()),
+                ('average_response_time_max', models.FloatField()),
+                ('average_response_time_avg', models.FloatField()),
+                ('average_response_time_last', models.FloatField()),
+                ('fulfillment_rate_min', models.FloatField()),
+                ('fulfillment_rate_max', models.FloatField()),
+                ('fulfillment_rate_avg', models.FloatField()),
+                ('fulfillment_rate_last', models.FloatField()),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='performance_rollups', to='testapp.vendor')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'resolution', 'bucket_start'), name='unique_performance_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Ranking weights and quality rating scale of the settings when this migration was written. Rankings under other
+# weights are rebuilt with `recompute_vendor_metrics --rankings`.
+WEIGHTS = {
+    'on_time_delivery_rate': 0.35,
+    'quality_rating_avg': 0.35,
+    'average_response_time': 0.1,
+    'fulfillment_rate': 0.2,
+}
+QUALITY_RATING_SCALE = 5
+
+
+# Frozen copy of VendorRanking.composite_score_for, so later changes to the formula or settings do not change this
+# migration
+def composite_score_for(metrics):
+    scores = {
+        'on_time_delivery_rate': metrics['on_time_delivery_rate'],
+        'quality_rating_avg': min(metrics['quality_rating_avg'] / QUALITY_RATING_SCALE * 100, 100),
+        'average_response_time': 100 / (1 + max(metrics['average_response_time'], 0) / 24),
+        'fulfillment_rate': metrics['fulfillment_rate'],
+    }
+    return sum(score * WEIGHTS[name] for name, score in scores.items()) / sum(WEIGHTS.values())
+
+
+# Ranks the existing vendors
+def build_rankings(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Vendor = apps.get_model('testapp', 'Vendor')
+    VendorRanking = apps.get_model('testapp', 'VendorRanking')
+    fields = ('on_time_delivery_rate', 'quality_rating_avg', 'average_response_time', 'fulfillment_rate')
+    rankings = []
+    for metrics in Vendor.objects.using(alias).values('vendor_code', *fields).iterator():
+        vendor_code = metrics.pop('vendor_code')
+        rankings.append(VendorRanking(vendor_id=vendor_code, composite_score=composite_score_for(metrics), **metrics))
+    VendorRanking.objects.using(alias).bulk_create(rankings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0005_metric_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorRanking',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='testapp.vendor')),
+                ('on_time_delivery_rate', models.FloatField()),
+                ('quality_rating_avg', models.FloatField()),
+                ('average_response_time', models.FloatField()),
+                ('fulfillment_rate', models.FloatField()),
+                ('composite_score', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-on_time_delivery_rate', 'vendor'], name='ranking_on_time_idx'), models.Index(fields=['-quality_rating_avg', 'vendor'], name='ranking_quality_idx'), models.Index(fields=['average_response_time', 'vendor'], name='ranking_response_time_idx'), models.Index(fields=['-fulfillment_rate', 'vendor'], name='ranking_fulfillment_idx'), models.Index(fields=['-composite_score', 'vendor'], name='ranking_composite_idx')],
+            },
+        ),
+        migrations.RunPython(build_rankings, migrations.RunPython.noop),
+    ]
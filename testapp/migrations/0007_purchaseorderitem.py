@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Keys of an items entry read as its SKU and as its quantity, as PurchaseOrderItem defined them when this
+# migration was written
+SKU_KEYS = ('sku', 'item_code', 'item_name', 'name')
+QUANTITY_KEYS = ('qty', 'quantity')
+
+
+# Frozen copy of PurchaseOrderItem.lines_from, so later changes to the parser do not change this migration
+def lines_from(items):
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        return ()
+    lines = []
+    for entry in items:
+        quantity = 1
+        if isinstance(entry, dict):
+            sku = next((entry[key] for key in SKU_KEYS if entry.get(key) not in (None, '')), None)
+            value = next((entry[key] for key in QUANTITY_KEYS if key in entry), 1)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                quantity = int(value)
+        else:
+            sku = entry
+        if isinstance(sku, (str, int, float)) and not isinstance(sku, bool) and sku != '':
+            lines.append((str(sku)[:255], quantity))
+    return tuple(lines)
+
+
+# Splits the items of every existing order into line items, inserting them in batches
+def build_line_items(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    PurchaseOrder = apps.get_model('testapp', 'PurchaseOrder')
+    PurchaseOrderItem = apps.get_model('testapp', 'PurchaseOrderItem')
+    line_items = []
+    for po_number, vendor_code, items in PurchaseOrder.objects.using(alias) \
+            .values_list('pk', 'vendor_id', 'items').iterator(chunk_size=2000):
+        for line, (sku, quantity) in enumerate(lines_from(items)):
+            line_items.append(PurchaseOrderItem(purchase_order_id=po_number, vendor_id=vendor_code, line=line,
+                                                sku=sku, quantity=quantity))
+        if len(line_items) >= 5000:
+            PurchaseOrderItem.objects.using(alias).bulk_create(line_items, batch_size=500)
+            line_items = []
+    PurchaseOrderItem.objects.using(alias).bulk_create(line_items, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0006_vendorranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseOrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line', models.PositiveIntegerField()),
+                ('sku', models.CharField(max_length=255)),
+                ('quantity', models.IntegerField()),
+                ('purchase_order', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='testapp.purchaseorder')),
+                ('vendor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='testapp.vendor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sku', 'id'], name='po_item_sku_idx'), models.Index(fields=['sku', 'vendor', 'quantity'], name='po_item_sku_vendor_idx'), models.Index(fields=['vendor', 'sku', 'quantity'], name='po_item_vendor_sku_idx')],
+                'constraints': [models.UniqueConstraint(fields=('purchase_order', 'line'), name='unique_po_item_line')],
+            },
+        ),
+        migrations.RunPython(build_line_items, migrations.RunPython.noop),
+    ]
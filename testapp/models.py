@@ -1,10 +1,52 @@
-from django.db import models
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
-from django.db.models import F, Avg, ExpressionWrapper
+from django.db.models import F, Q, Avg, Count, Sum, ExpressionWrapper
 from django.utils import timezone
+from datetime import timedelta
+from .instrumentation import timed_vendor_update
+from .authentication import invalidate_tokens
+
+
+# Number of rows removed per raw DELETE statement by the bulk delete methods
+BULK_DELETE_BATCH_SIZE = 1000
+
+
+# QuerySet to delete vendors without loading their purchase orders or running the per-order metric signals
+class VendorQuerySet(models.QuerySet):
+    # Method to delete the vendors after removing their orders in raw batches, so the cascade finds no orders to
+    # load and signal. Returns the same (total, per-model counts) as QuerySet.delete(), orders included.
+    def bulk_delete(self, batch_size=BULK_DELETE_BATCH_SIZE):
+        with transaction.atomic(using=self.db):
+            vendor_codes = list(self.values_list('pk', flat=True))
+            orders, _ = PurchaseOrder.objects.using(self.db).filter(vendor__in=vendor_codes) \
+                .bulk_delete(batch_size, recompute=False)
+            total, counts = Vendor.objects.using(self.db).filter(pk__in=vendor_codes).delete()
+        if orders:
+            counts[PurchaseOrder._meta.label] = orders
+        return total + orders, counts
+
+
+# QuerySet to delete purchase orders without running the per-order metric signals
+class PurchaseOrderQuerySet(models.QuerySet):
+    # Method to delete the orders with raw DELETE statements of batch_size rows each, then mark every affected vendor
+    # dirty once, so its metrics are recomputed as VENDOR_METRICS_MODE says (on commit, or by the queue worker).
+    # Returns the same (total, per-model counts) as QuerySet.delete().
+    def bulk_delete(self, batch_size=BULK_DELETE_BATCH_SIZE, recompute=True):
+        from .signals import mark_vendor_dirty  # signals imports this module
+        with transaction.atomic(using=self.db):
+            rows = list(self.order_by().values_list('pk', 'vendor_id'))
+            for start in range(0, len(rows), batch_size):
+                po_numbers = [po_number for po_number, _ in rows[start:start + batch_size]]
+                PurchaseOrderItem.objects.using(self.db).filter(purchase_order__in=po_numbers)._raw_delete(self.db)
+                PurchaseOrder.objects.using(self.db).filter(pk__in=po_numbers)._raw_delete(self.db)
+            if recompute:
+                for vendor_code in {vendor_code for _, vendor_code in rows}:
+                    mark_vendor_dirty(vendor_code, self.db)
+        return len(rows), {PurchaseOrder._meta.label: len(rows)} if rows else {}
 
 
 # Model to represent a Vendor
@@ -19,6 +61,11 @@ class Vendor(models.Model):
     average_response_time = models.FloatField(default=0.0)
     fulfillment_rate = models.FloatField(default=0.0)
 
+    objects = VendorQuerySet.as_manager()
+
+    # Names of the performance metric fields, in the order they are reported
+    METRIC_FIELDS = ('on_time_delivery_rate', 'quality_rating_avg', 'average_response_time', 'fulfillment_rate')
+
     # Method to save current performance metrics as a historical record
     def save_historical_performance(self):
         HistoricalPerformance.objects.create(
@@ -31,6 +78,7 @@ class Vendor(models.Model):
         )
 
     # Method to update the on-time delivery rate based on completed orders
+    @timed_vendor_update
     def update_on_time_delivery_rate(self):
         # Filter completed orders for this vendor
         completed_orders = self.purchase_orders.filter(status='Complete')
@@ -46,23 +94,25 @@ class Vendor(models.Model):
 
         if new_rate != self.on_time_delivery_rate:
             self.on_time_delivery_rate = new_rate
-            self.save()
+            self.save(update_fields=['on_time_delivery_rate'])
             self.save_historical_performance()  # Save the updated rate to the vendor
 
     # Method to update the average quality rating from received quality ratings
+    @timed_vendor_update
     def update_quality_rating_avg(self):
         # Filter to obtain only those purchase orders associated with the vendor that have a non-null quality rating
         ratings = self.purchase_orders.filter(quality_rating__isnull=False)
         new_avg = ratings.aggregate(Avg('quality_rating'))['quality_rating__avg'] or 0
         if new_avg != self.quality_rating_avg:
             self.quality_rating_avg = new_avg
-            self.save()
+            self.save(update_fields=['quality_rating_avg'])
             self.save_historical_performance()
 
     # Method to calculate and update average response time for order acknowledgments
+    @timed_vendor_update
     def update_average_response_time(self):
         # Retrieve purchase orders associated with this vendor that have an acknowledgment date set (not null)
-        responses = self.purchase_orders.exclude(acknowledgment_date__isnull=True).annotate(
+        responses = self.purchase_orders.filter(acknowledgment_date__isnull=False).annotate(
             # Calculate the response time for each order by subtracting the issue date from the acknowledgment date
             response_time=ExpressionWrapper(
                 F('acknowledgment_date') - F('issue_date'),
@@ -81,19 +131,60 @@ class Vendor(models.Model):
         # Check if there is a change from the current average_response_time
         if new_avg_response_time != self.average_response_time:
             self.average_response_time = new_avg_response_time
-            self.save()
+            self.save(update_fields=['average_response_time'])
             self.save_historical_performance()
 
     # Method to compute and update the fulfillment rate based on completed and rated orders
+    @timed_vendor_update
     def update_fulfillment_rate(self):
         total_orders = self.purchase_orders.count()
         fulfilled_orders = self.purchase_orders.filter(status='Complete', quality_rating__isnull=False).count()
         new_rate = (fulfilled_orders / total_orders) * 100 if total_orders > 0 else 0
         if new_rate != self.fulfillment_rate:
             self.fulfillment_rate = new_rate
-            self.save()
+            self.save(update_fields=['fulfillment_rate'])
             self.save_historical_performance()
 
+    # Method to store a full set of metric values, writing the vendor once and recording a single history row
+    @timed_vendor_update
+    def store_metrics(self, metrics):
+        changed = [name for name in self.METRIC_FIELDS if metrics[name] != getattr(self, name)]
+        if not changed:
+            return False
+        for name in changed:
+            setattr(self, name, metrics[name])
+        self.save(update_fields=changed)
+        self.save_historical_performance()
+        return True
+
+    # Method to apply a purchase order delta to the running accumulator and refresh the metrics from it in O(1).
+    # The UPDATE locks the accumulator row until the transaction ends, so concurrent deltas of a vendor run one after
+    # the other; the stored metrics are then re-read with the accumulator, so the comparison in store_metrics is
+    # against the database rather than this possibly stale instance.
+    @timed_vendor_update
+    def apply_metric_delta(self, delta):
+        changes = {name: F(name) + value for name, value in delta.items() if value}
+        if not changes:
+            return False
+        using = self._state.db or router.db_for_write(Vendor, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            accumulators = VendorMetricAccumulator.objects.using(using).filter(vendor=self)
+            if accumulators.update(**changes):
+                accumulator = accumulators.select_related('vendor').get()
+                for name in self.METRIC_FIELDS:
+                    setattr(self, name, getattr(accumulator.vendor, name))
+                return self.store_metrics(accumulator.metrics())
+            # No accumulator yet (e.g. rows written before it existed), so build it from the current orders
+            return self.refresh_metrics()
+
+    # Method to recompute all four metrics from the purchase orders in one conditional-aggregate query,
+    # resynchronising the accumulator and writing the vendor at most once
+    @timed_vendor_update
+    def refresh_metrics(self):
+        counters = VendorMetricAccumulator.recount(self)
+        VendorMetricAccumulator.objects.update_or_create(vendor=self, defaults=counters)
+        return self.store_metrics(VendorMetricAccumulator.derive_metrics(counters))
+
     # String representation of the Vendor model
     def __str__(self):
         return self.name + ' ' + self.vendor_code
@@ -119,6 +210,138 @@ class PurchaseOrder(models.Model):
     issue_date = models.DateTimeField()
     acknowledgment_date = models.DateTimeField(null=True, blank=True)
 
+    objects = PurchaseOrderQuerySet.as_manager()
+
+    # Indexes matching the metric queries, which always filter one vendor's orders, and the vendor-filtered list
+    class Meta:
+        indexes = [
+            models.Index(fields=['vendor', 'status'], name='po_vendor_status_idx'),
+            models.Index(fields=['vendor', 'quality_rating'], name='po_vendor_rated_idx',
+                         condition=Q(quality_rating__isnull=False)),
+            models.Index(fields=['vendor', 'acknowledgment_date', 'issue_date'], name='po_vendor_acknowledged_idx',
+                         condition=Q(acknowledgment_date__isnull=False)),
+            models.Index(fields=['vendor', 'po_number'], name='po_vendor_po_number_idx'),
+        ]
+
+    # Fields whose values feed the vendor metric accumulators
+    METRIC_SOURCE_FIELDS = ('vendor_id', 'status', 'quality_rating', 'expected_delivery_date',
+                            'final_delivery_date', 'issue_date', 'acknowledgment_date')
+
+    # Saves the order in one transaction with the post_save receivers that apply its delta to the accumulators and
+    # vendors, so a failure part way leaves none of them changed
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(PurchaseOrder, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+    # Deletes the order in one transaction with the post_delete receivers, as save does
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic(using=using or router.db_for_write(PurchaseOrder, instance=self), savepoint=False):
+            return super().delete(using=using, keep_parents=keep_parents)
+
+    # Remember the stored state of the order so that a later save or delete can apply its delta to the accumulator
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.METRIC_SOURCE_FIELDS):
+            instance._metric_snapshot = instance.metric_snapshot()
+        if 'items' in field_names and 'vendor_id' in field_names:
+            instance._line_item_snapshot = instance.line_item_snapshot()
+        return instance
+
+    # Method to compute what this order contributes to each of its vendor's accumulator counters
+    def metric_contribution(self):
+        completed = self.status == 'Complete'
+        rated = self.quality_rating is not None
+        acknowledged = self.acknowledgment_date is not None
+        on_time = completed and self.final_delivery_date is not None \
+            and self.final_delivery_date <= self.expected_delivery_date
+        return {
+            'total_orders': 1,
+            'completed_orders': int(completed),
+            'on_time_orders': int(on_time),
+            'rated_orders': int(rated),
+            'quality_rating_sum': self.quality_rating if rated else 0.0,
+            'fulfilled_orders': int(completed and rated),
+            'acknowledged_orders': int(acknowledged),
+            # Response times are summed in whole microseconds so that repeated deltas never drift
+            'response_time_sum': (self.acknowledgment_date - self.issue_date) // timedelta(microseconds=1)
+            if acknowledged else 0,
+        }
+
+    # Method to pair the contribution with the vendor it is counted against
+    def metric_snapshot(self):
+        return self.vendor_id, self.metric_contribution()
+
+    # Method to pair the (sku, quantity) lines parsed from items with the vendor they are stored against
+    def line_item_snapshot(self):
+        return self.vendor_id, PurchaseOrderItem.lines_from(self.items)
+
+
+# Model holding one row per entry of PurchaseOrder.items, so orders can be filtered and quantities summed by SKU and
+# vendor from indexes instead of parsing every order's JSON. Rows are rewritten whenever an order's items or vendor
+# change and removed with the order.
+class PurchaseOrderItem(models.Model):
+    # Covered by the unique (purchase_order, line) constraint and the vendor index, so no separate FK indexes
+    purchase_order = models.ForeignKey(PurchaseOrder, related_name='line_items', on_delete=models.CASCADE,
+                                       db_index=False)
+    vendor = models.ForeignKey(Vendor, related_name='line_items', on_delete=models.CASCADE, db_index=False)
+    line = models.PositiveIntegerField()  # Position of the entry within items
+    sku = models.CharField(max_length=255)
+    quantity = models.IntegerField()
+
+    # Keys of an items entry read as its SKU and as its quantity, in order of preference
+    SKU_KEYS = ('sku', 'item_code', 'item_name', 'name')
+    QUANTITY_KEYS = ('qty', 'quantity')
+
+    # The sku and vendor indexes end with quantity, so per-SKU and per-vendor totals are read from the index alone
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['purchase_order', 'line'], name='unique_po_item_line'),
+        ]
+        indexes = [
+            models.Index(fields=['sku', 'id'], name='po_item_sku_idx'),
+            models.Index(fields=['sku', 'vendor', 'quantity'], name='po_item_sku_vendor_idx'),
+            models.Index(fields=['vendor', 'sku', 'quantity'], name='po_item_vendor_sku_idx'),
+        ]
+
+    # Method to parse items into (sku, quantity) lines. Entries are objects carrying one of SKU_KEYS (and optionally
+    # one of QUANTITY_KEYS, defaulting to 1) or plain SKU strings; anything else has no line.
+    @classmethod
+    def lines_from(cls, items):
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list):
+            return ()
+        lines = []
+        for entry in items:
+            quantity = 1
+            if isinstance(entry, dict):
+                sku = next((entry[key] for key in cls.SKU_KEYS if entry.get(key) not in (None, '')), None)
+                value = next((entry[key] for key in cls.QUANTITY_KEYS if key in entry), 1)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    quantity = int(value)
+            else:
+                sku = entry
+            if isinstance(sku, (str, int, float)) and not isinstance(sku, bool) and sku != '':
+                lines.append((str(sku)[:255], quantity))
+        return tuple(lines)
+
+    # Method to rewrite the line items of the given orders, deleting their old rows first unless replace is False
+    # (e.g. for orders that were just inserted)
+    @classmethod
+    def sync(cls, orders, using='default', replace=True):
+        if replace:
+            po_numbers = [order.pk for order in orders]
+            for start in range(0, len(po_numbers), BULK_DELETE_BATCH_SIZE):
+                cls.objects.using(using).filter(
+                    purchase_order__in=po_numbers[start:start + BULK_DELETE_BATCH_SIZE])._raw_delete(using)
+        cls.objects.using(using).bulk_create([
+            cls(purchase_order_id=order.pk, vendor_id=order.vendor_id, line=line, sku=sku, quantity=quantity)
+            for order in orders
+            for line, (sku, quantity) in enumerate(cls.lines_from(order.items))
+        ], batch_size=500)
+
 
 # Model to store historical performance data of a vendor
 class HistoricalPerformance(models.Model):
@@ -129,9 +352,189 @@ class HistoricalPerformance(models.Model):
     average_response_time = models.FloatField()
     fulfillment_rate = models.FloatField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['vendor', 'date'], name='hp_vendor_date_idx'),
+        ]
+
+
+# Model to store compacted HistoricalPerformance snapshots as hourly, daily and monthly buckets, keeping the
+# minimum, maximum, average and last value of every metric within each bucket
+class PerformanceRollup(models.Model):
+    RESOLUTION_CHOICES = (
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+        ('month', 'Month'),
+    )
+
+    vendor = models.ForeignKey(Vendor, related_name='performance_rollups', on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=5, choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    samples = models.IntegerField()
+    last_at = models.DateTimeField()
+    on_time_delivery_rate_min = models.FloatField()
+    on_time_delivery_rate_max = models.FloatField()
+    on_time_delivery_rate_avg = models.FloatField()
+    on_time_delivery_rate_last = models.FloatField()
+    quality_rating_avg_min = models.FloatField()
+    quality_rating_avg_max = models.FloatField()
+    quality_rating_avg_avg = models.FloatField()
+    quality_rating_avg_last = models.FloatField()
+    average_response_time_min = models.FloatField()
+    average_response_time_max = models.FloatField()
+    average_response_time_avg = models.FloatField()
+    average_response_time_last = models.FloatField()
+    fulfillment_rate_min = models.FloatField()
+    fulfillment_rate_max = models.FloatField()
+    fulfillment_rate_avg = models.FloatField()
+    fulfillment_rate_last = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'resolution', 'bucket_start'], name='unique_performance_rollup'),
+        ]
+
+
+# Model to keep running counts and sums of a vendor's purchase orders so metrics can be updated incrementally
+class VendorMetricAccumulator(models.Model):
+    vendor = models.OneToOneField(Vendor, related_name='metric_accumulator', on_delete=models.CASCADE, primary_key=True)
+    total_orders = models.BigIntegerField(default=0)
+    completed_orders = models.BigIntegerField(default=0)
+    on_time_orders = models.BigIntegerField(default=0)
+    rated_orders = models.BigIntegerField(default=0)
+    quality_rating_sum = models.FloatField(default=0.0)
+    fulfilled_orders = models.BigIntegerField(default=0)
+    acknowledged_orders = models.BigIntegerField(default=0)
+    response_time_sum = models.BigIntegerField(default=0)  # In microseconds
+
+    COUNTER_FIELDS = ('total_orders', 'completed_orders', 'on_time_orders', 'rated_orders', 'quality_rating_sum',
+                      'fulfilled_orders', 'acknowledged_orders', 'response_time_sum')
+
+    # Method to build the conditional aggregates that compute every counter from a set of purchase orders
+    @staticmethod
+    def counter_aggregates():
+        completed = Q(status='Complete')
+        return {
+            'total_orders': Count('pk'),
+            'completed_orders': Count('pk', filter=completed),
+            'on_time_orders': Count('pk', filter=completed & Q(final_delivery_date__lte=F('expected_delivery_date'))),
+            'rated_orders': Count('pk', filter=Q(quality_rating__isnull=False)),
+            'quality_rating_sum': Sum('quality_rating'),
+            'fulfilled_orders': Count('pk', filter=completed & Q(quality_rating__isnull=False)),
+            'acknowledged_orders': Count('pk', filter=Q(acknowledgment_date__isnull=False)),
+            'response_time_sum': Sum(ExpressionWrapper(F('acknowledgment_date') - F('issue_date'),
+                                                       output_field=models.DurationField())),
+        }
+
+    # Method to turn the raw aggregate results into stored counter values (no orders means zeros, not NULLs)
+    @classmethod
+    def normalize_counters(cls, row):
+        counters = {name: row.get(name) or 0 for name in cls.COUNTER_FIELDS}
+        counters['quality_rating_sum'] = float(counters['quality_rating_sum'])
+        response_time = counters['response_time_sum']
+        counters['response_time_sum'] = response_time // timedelta(microseconds=1) if response_time else 0
+        return counters
+
+    # Method to recount every counter for a vendor from its purchase orders in a single aggregate query
+    @classmethod
+    def recount(cls, vendor):
+        return cls.normalize_counters(vendor.purchase_orders.aggregate(**cls.counter_aggregates()))
+
+    # Method to derive the four vendor metrics from a set of counters
+    @staticmethod
+    def derive_metrics(counters):
+        completed, rated = counters['completed_orders'], counters['rated_orders']
+        acknowledged, total = counters['acknowledged_orders'], counters['total_orders']
+        return {
+            'on_time_delivery_rate': (counters['on_time_orders'] / completed) * 100 if completed > 0 else 0,
+            'quality_rating_avg': counters['quality_rating_sum'] / rated if rated > 0 else 0,
+            'average_response_time':
+                counters['response_time_sum'] / acknowledged / 1e6 / 3600.0 if acknowledged > 0 else 0,
+            'fulfillment_rate': (counters['fulfilled_orders'] / total) * 100 if total > 0 else 0,
+        }
+
+    # Method to derive the four vendor metrics from the accumulated counters
+    def metrics(self):
+        return self.derive_metrics({name: getattr(self, name) for name in self.COUNTER_FIELDS})
+
+
+# Model holding a copy of every vendor's metrics plus a composite score, indexed for ordered leaderboard reads.
+# Rows are refreshed whenever a vendor's metric fields are written.
+class VendorRanking(models.Model):
+    vendor = models.OneToOneField(Vendor, related_name='ranking', on_delete=models.CASCADE, primary_key=True)
+    on_time_delivery_rate = models.FloatField()
+    quality_rating_avg = models.FloatField()
+    average_response_time = models.FloatField()
+    fulfillment_rate = models.FloatField()
+    composite_score = models.FloatField()
+
+    RANKED_FIELDS = Vendor.METRIC_FIELDS + ('composite_score',)
+    # Metrics where a smaller value ranks higher
+    LOWER_IS_BETTER = ('average_response_time',)
+
+    # Each index is in best-first order, so top-N pages scan it forwards and bottom-N pages backwards
+    class Meta:
+        indexes = [
+            models.Index(fields=['-on_time_delivery_rate', 'vendor'], name='ranking_on_time_idx'),
+            models.Index(fields=['-quality_rating_avg', 'vendor'], name='ranking_quality_idx'),
+            models.Index(fields=['average_response_time', 'vendor'], name='ranking_response_time_idx'),
+            models.Index(fields=['-fulfillment_rate', 'vendor'], name='ranking_fulfillment_idx'),
+            models.Index(fields=['-composite_score', 'vendor'], name='ranking_composite_idx'),
+        ]
+
+    # Method to compute a 0-100 score from a vendor's metrics using the VENDOR_RANKING_WEIGHTS setting. Ratings are
+    # scaled by VENDOR_QUALITY_RATING_SCALE and response times turn into 100 / (1 + days to acknowledge).
+    @staticmethod
+    def composite_score_for(metrics):
+        weights = getattr(settings, 'VENDOR_RANKING_WEIGHTS', {})
+        scale = getattr(settings, 'VENDOR_QUALITY_RATING_SCALE', 5)
+        scores = {
+            'on_time_delivery_rate': metrics['on_time_delivery_rate'],
+            'quality_rating_avg': min(metrics['quality_rating_avg'] / scale * 100, 100),
+            'average_response_time': 100 / (1 + max(metrics['average_response_time'], 0) / 24),
+            'fulfillment_rate': metrics['fulfillment_rate'],
+        }
+        total_weight = sum(weights.get(name, 1) for name in scores)
+        return sum(score * weights.get(name, 1) for name, score in scores.items()) / total_weight
+
+    # Method to upsert the ranking rows of the given vendors with a single INSERT ... ON CONFLICT statement
+    @classmethod
+    def refresh(cls, vendors):
+        rankings = []
+        for vendor in vendors:
+            metrics = {name: getattr(vendor, name) for name in Vendor.METRIC_FIELDS}
+            rankings.append(cls(vendor_id=vendor.pk, composite_score=cls.composite_score_for(metrics), **metrics))
+        cls.objects.bulk_create(rankings, batch_size=500, update_conflicts=True, unique_fields=['vendor'],
+                                update_fields=cls.RANKED_FIELDS)
+        # The upsert may have added vendors; drop the cached total now and again on commit
+        from .performance_cache import invalidate_ranking_total  # performance_cache imports this module
+        invalidate_ranking_total()
+        transaction.on_commit(invalidate_ranking_total)
+
+
+# Model to queue vendors whose metrics must be recomputed by the process_dirty_vendors worker
+class DirtyVendor(models.Model):
+    vendor = models.OneToOneField(Vendor, related_name='dirty_mark', on_delete=models.CASCADE, primary_key=True)
+    marked_at = models.DateTimeField(auto_now_add=True)
+
 
 # This section is to create an authentication token for users on the site.
 @receiver(post_save, sender=User)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+# Drops a user's cached tokens whenever the user changes (e.g. is deactivated), so CachedTokenAuthentication
+# re-reads them. Logins only touch last_login and keep the cache.
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if not created and set(update_fields or ()) != {'last_login'}:
+        invalidate_tokens(Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+# Drops a cached token when it is deleted or rotated (a new key is a new Token, the old one is deleted)
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance=None, **kwargs):
+    invalidate_tokens([instance.key])
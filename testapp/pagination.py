@@ -0,0 +1,56 @@
+from django.conf import settings
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+# Keyset pagination on an indexed, unique column: every page is one indexed range scan, however deep it is.
+class KeysetPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+
+    # Reads API_PAGE_SIZE and API_MAX_PAGE_SIZE per request, so settings overrides apply
+    def get_page_size(self, request):
+        self.page_size = getattr(settings, 'API_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+        return super().get_page_size(request)
+
+    # Async counterpart of paginate_queryset and get_paginated_response for the async read views, returning the
+    # {next, previous, results} body. The ordering column is unique, so a cursor only needs the position it
+    # continues from, and the cursors are interchangeable with the sync endpoints' ones.
+    async def apaginate(self, queryset, request, serialize):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        if cursor is not None and cursor.position is not None:
+            queryset = queryset.filter(**{f'{self.ordering}__{"lt" if reverse else "gt"}': cursor.position})
+        rows = [row async for row in queryset.order_by(f'-{self.ordering}' if reverse else self.ordering)
+                [:self.page_size + 1]]
+        page = rows[:self.page_size]
+        if reverse:
+            page.reverse()
+        has_next = reverse or len(rows) > self.page_size
+        has_previous = len(rows) > self.page_size if reverse else cursor is not None
+        return {
+            'next': self.async_link(page[-1], False) if has_next and page else None,
+            'previous': self.async_link(page[0], True) if has_previous and page else None,
+            'results': serialize(page),
+        }
+
+    def async_link(self, instance, reverse):
+        position = self._get_position_from_instance(instance, [self.ordering])
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=position))
+
+
+# Pages purchase orders by their po_number primary key.
+class PurchaseOrderPagination(KeysetPagination):
+    ordering = 'po_number'
+
+
+# Pages historical performance rows by their auto-incremented id, i.e. in the order they were recorded.
+class HistoricalPerformancePagination(KeysetPagination):
+    ordering = 'id'
+
+
+# Pages purchase order line items by their auto-incremented id.
+class PurchaseOrderItemPagination(KeysetPagination):
+    ordering = 'id'
@@ -0,0 +1,110 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+from .models import Vendor, HistoricalPerformance, VendorRanking
+
+KEY_PREFIX = 'vendor-performance:'
+RANKING_TOTAL_KEY = 'vendor-ranking-total'
+
+
+# Returns the cache holding vendor performance entries (VENDOR_PERFORMANCE_CACHE names an alias in CACHES)
+def performance_cache():
+    return caches[getattr(settings, 'VENDOR_PERFORMANCE_CACHE', 'default')]
+
+
+# Builds the cached entry for a vendor: its metrics, an ETag derived from them and when they last changed
+def build_entry(metrics, last_modified):
+    etag = hashlib.md5(json.dumps(metrics, sort_keys=True).encode()).hexdigest()
+    return {'metrics': metrics, 'etag': f'"{etag}"', 'last_modified': last_modified}
+
+
+# Returns the query of the newest snapshot date of each given vendor. It reads the primary, like the vendor rows,
+# since a lagging replica would pair new metrics with an old Last-Modified for the whole cache timeout.
+def last_modified_query(vendor_codes):
+    return HistoricalPerformance.objects.using(DEFAULT_DB_ALIAS).filter(vendor_id__in=vendor_codes).order_by() \
+        .values('vendor_id').annotate(last=Max('date')).values_list('vendor_id', 'last')
+
+
+# Loads the entries of the given vendors from the database; every metric write records a history row, so the
+# newest one tells when the metrics last changed
+def load_entries(vendor_codes):
+    rows = Vendor.objects.filter(pk__in=vendor_codes).values('vendor_code', *Vendor.METRIC_FIELDS)
+    last_modified = dict(last_modified_query(vendor_codes))
+    entries = {}
+    for row in rows:
+        vendor_code = row.pop('vendor_code')
+        entries[vendor_code] = build_entry(row, last_modified.get(vendor_code))
+    return entries
+
+
+# Async counterpart of load_entries, reading through the async ORM
+async def aload_entries(vendor_codes):
+    last_modified = {}
+    async for vendor_code, last in last_modified_query(vendor_codes):
+        last_modified[vendor_code] = last
+    entries = {}
+    async for row in Vendor.objects.filter(pk__in=vendor_codes).values('vendor_code', *Vendor.METRIC_FIELDS):
+        vendor_code = row.pop('vendor_code')
+        entries[vendor_code] = build_entry(row, last_modified.get(vendor_code))
+    return entries
+
+
+# Returns {vendor_code: entry} for the vendors that exist, reading the cache first and the database for misses
+def get_performance_entries(vendor_codes):
+    cache = performance_cache()
+    cached = cache.get_many([KEY_PREFIX + code for code in vendor_codes])
+    entries = {key[len(KEY_PREFIX):]: entry for key, entry in cached.items()}
+    missing = [code for code in vendor_codes if code not in entries]
+    if missing:
+        loaded = load_entries(missing)
+        cache.set_many({KEY_PREFIX + code: entry for code, entry in loaded.items()},
+                       getattr(settings, 'VENDOR_PERFORMANCE_CACHE_TIMEOUT', 300))
+        entries.update(loaded)
+    return entries
+
+
+# Async counterpart of get_performance_entries
+async def aget_performance_entries(vendor_codes):
+    cache = performance_cache()
+    cached = await cache.aget_many([KEY_PREFIX + code for code in vendor_codes])
+    entries = {key[len(KEY_PREFIX):]: entry for key, entry in cached.items()}
+    missing = [code for code in vendor_codes if code not in entries]
+    if missing:
+        loaded = await aload_entries(missing)
+        await cache.aset_many({KEY_PREFIX + code: entry for code, entry in loaded.items()},
+                              getattr(settings, 'VENDOR_PERFORMANCE_CACHE_TIMEOUT', 300))
+        entries.update(loaded)
+    return entries
+
+
+# Returns the entry of one vendor, or None if it does not exist
+def get_performance_entry(vendor_code):
+    return get_performance_entries([vendor_code]).get(vendor_code)
+
+
+async def aget_performance_entry(vendor_code):
+    return (await aget_performance_entries([vendor_code])).get(vendor_code)
+
+
+# Drops the cached entries of the given vendors so the next read reloads them
+def invalidate_performance(vendor_codes):
+    performance_cache().delete_many([KEY_PREFIX + code for code in vendor_codes])
+
+
+# Returns the number of ranked vendors, so leaderboard pages do not count the ranking table on every request. It is
+# counted on the primary, like the Last-Modified dates, whenever the ranking table was refreshed since.
+def get_ranking_total():
+    cache = performance_cache()
+    total = cache.get(RANKING_TOTAL_KEY)
+    if total is None:
+        total = VendorRanking.objects.using(DEFAULT_DB_ALIAS).count()
+        cache.set(RANKING_TOTAL_KEY, total, getattr(settings, 'VENDOR_PERFORMANCE_CACHE_TIMEOUT', 300))
+    return total
+
+
+def invalidate_ranking_total():
+    performance_cache().delete(RANKING_TOTAL_KEY)
@@ -0,0 +1,25 @@
+import json
+
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+
+
+# JSONRenderer that writes the same bytes faster for views that set plain_json, i.e. whose response data holds
+# only dicts, lists, strings, numbers, booleans and None (as built by the fast list path). Such data is encoded
+# by the plain C encoder, skipping the circular reference checks and the DRF encoder's default() hook.
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        view = renderer_context.get('view')
+        if data is None or not getattr(view, 'plain_json', False) \
+                or self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = self.plain_encoder().encode(data)
+        # Escaped like JSONRenderer, so the output stays a strict JavaScript subset
+        if '\u2028' in ret or '\u2029' in ret:
+            ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode()
+
+    def plain_encoder(self):
+        return json.JSONEncoder(ensure_ascii=self.ensure_ascii, allow_nan=not self.strict, check_circular=False,
+                                separators=SHORT_SEPARATORS if self.compact else LONG_SEPARATORS)
@@ -0,0 +1,154 @@
+from datetime import timedelta
+
+from django.db.models import Avg, Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from .models import Vendor, HistoricalPerformance, PerformanceRollup
+
+METRIC_FIELDS = Vendor.METRIC_FIELDS
+STATISTICS = ('min', 'max', 'avg', 'last')
+
+# Bucket resolutions from finest to coarsest with their database truncation and (shortest) width
+RESOLUTIONS = {
+    'hour': (TruncHour, timedelta(hours=1)),
+    'day': (TruncDay, timedelta(days=1)),
+    'month': (TruncMonth, timedelta(days=28)),
+}
+
+# Longest possible bucket, used to find buckets that start before a range but overlap it
+MAX_BUCKET_WIDTH = timedelta(days=31)
+
+# Number of ids looked up per IN query when fetching the last snapshot of each bucket
+LOOKUP_BATCH_SIZE = 500
+
+
+# Groups snapshots into buckets in the database and returns {(vendor_code, bucket_start): stats}
+def aggregate_snapshots(snapshots, resolution):
+    trunc = RESOLUTIONS[resolution][0]
+    aggregates = {'samples': Count('id'), 'last_id': Max('id'), 'last_at': Max('date')}
+    for name in METRIC_FIELDS:
+        aggregates.update({f'{name}_min': Min(name), f'{name}_max': Max(name), f'{name}_avg': Avg(name)})
+    rows = snapshots.order_by().annotate(bucket_start=trunc('date')).values('vendor_id', 'bucket_start') \
+        .annotate(**aggregates)
+    buckets = {(row.pop('vendor_id'), row.pop('bucket_start')): row for row in rows}
+
+    # The last value of a bucket is read from its newest snapshot, fetched by id in batches
+    by_last_id = {stats.pop('last_id'): stats for stats in buckets.values()}
+    last_ids = list(by_last_id)
+    for start in range(0, len(last_ids), LOOKUP_BATCH_SIZE):
+        latest = HistoricalPerformance.objects.filter(pk__in=last_ids[start:start + LOOKUP_BATCH_SIZE])
+        for row in latest.values('id', *METRIC_FIELDS):
+            stats = by_last_id[row.pop('id')]
+            stats.update({f'{name}_last': value for name, value in row.items()})
+    return buckets
+
+
+# Combines the statistics of two partial buckets covering the same period
+def merge_buckets(first, second):
+    if second['last_at'] < first['last_at']:
+        first, second = second, first
+    samples = first['samples'] + second['samples']
+    merged = {'samples': samples, 'last_at': second['last_at']}
+    for name in METRIC_FIELDS:
+        merged[f'{name}_min'] = min(first[f'{name}_min'], second[f'{name}_min'])
+        merged[f'{name}_max'] = max(first[f'{name}_max'], second[f'{name}_max'])
+        merged[f'{name}_avg'] = (first[f'{name}_avg'] * first['samples']
+                                 + second[f'{name}_avg'] * second['samples']) / samples
+        merged[f'{name}_last'] = second[f'{name}_last']
+    return merged
+
+
+# Returns the stored statistics of a rollup row in the same shape as aggregate_snapshots
+def rollup_stats(rollup):
+    stats = {'samples': rollup.samples, 'last_at': rollup.last_at}
+    for name in METRIC_FIELDS:
+        for statistic in STATISTICS:
+            stats[f'{name}_{statistic}'] = getattr(rollup, f'{name}_{statistic}')
+    return stats
+
+
+# Folds a set of snapshots into the stored buckets of one resolution, returning how many buckets were written
+def store_rollups(snapshots, resolution):
+    buckets = aggregate_snapshots(snapshots, resolution)
+    if not buckets:
+        return 0
+    starts = [bucket_start for _, bucket_start in buckets]
+    existing = {
+        (rollup.vendor_id, rollup.bucket_start): rollup
+        for rollup in PerformanceRollup.objects.filter(
+            resolution=resolution, bucket_start__gte=min(starts), bucket_start__lte=max(starts),
+            vendor_id__in={vendor_code for vendor_code, _ in buckets})
+    }
+    created, updated = [], []
+    for (vendor_code, bucket_start), stats in buckets.items():
+        rollup = existing.get((vendor_code, bucket_start))
+        if rollup is None:
+            created.append(PerformanceRollup(vendor_id=vendor_code, resolution=resolution,
+                                             bucket_start=bucket_start, **stats))
+            continue
+        for name, value in merge_buckets(rollup_stats(rollup), stats).items():
+            setattr(rollup, name, value)
+        updated.append(rollup)
+    PerformanceRollup.objects.bulk_create(created, batch_size=LOOKUP_BATCH_SIZE)
+    if updated:
+        PerformanceRollup.objects.bulk_update(updated, ['samples', 'last_at'] + [
+            f'{name}_{statistic}' for name in METRIC_FIELDS for statistic in STATISTICS], batch_size=LOOKUP_BATCH_SIZE)
+    return len(created) + len(updated)
+
+
+# Picks the coarsest stored resolution whose buckets are no wider than the requested step
+def choose_resolution(step):
+    chosen = 'hour'
+    for resolution, (_, width) in RESOLUTIONS.items():
+        if width <= step:
+            chosen = resolution
+    return chosen
+
+
+# Picks the finest stored resolution that covers a span in no more than the given number of buckets
+def resolution_for_points(span, points):
+    for resolution, (_, width) in RESOLUTIONS.items():
+        if span / width <= points:
+            return resolution
+    return 'month'
+
+
+# Returns a vendor's bucketed series over [start, end], reading the rollup table and aggregating the raw
+# snapshots that have not been compacted yet into the same buckets
+def performance_series(vendor_code, start, end, resolution):
+    series = {
+        rollup.bucket_start: rollup_stats(rollup)
+        for rollup in PerformanceRollup.objects.filter(
+            vendor_id=vendor_code, resolution=resolution, bucket_start__gt=start - MAX_BUCKET_WIDTH,
+            bucket_start__lte=end, last_at__gte=start)
+    }
+    raw = HistoricalPerformance.objects.filter(vendor_id=vendor_code, date__gte=start, date__lte=end)
+    for (_, bucket_start), stats in aggregate_snapshots(raw, resolution).items():
+        series[bucket_start] = merge_buckets(series[bucket_start], stats) if bucket_start in series else stats
+    return [dict(stats, bucket_start=bucket_start) for bucket_start, stats in sorted(series.items())]
+
+
+# Returns {vendor_code: metrics} holding the latest snapshot of each vendor at or before as_of, with the time it was
+# recorded. Each vendor's snapshot is found by one backward seek on the (vendor, date) index inside a correlated
+# subquery, so all vendors are read in a single query. Vendors whose snapshots were already compacted fall back to
+# the last value of their newest hourly bucket that ended by then.
+def metrics_as_of(vendor_codes, as_of):
+    vendors = Vendor.objects.filter(pk__in=vendor_codes)
+    latest = HistoricalPerformance.objects.filter(vendor=OuterRef('pk'), date__lte=as_of).order_by('-date', '-id')
+    snapshots = HistoricalPerformance.objects.filter(
+        pk__in=vendors.annotate(snapshot_id=Subquery(latest.values('id')[:1])).values('snapshot_id'))
+    found = {}
+    for row in snapshots.values('vendor_id', 'date', *METRIC_FIELDS):
+        found[row.pop('vendor_id')] = dict(row, recorded_at=row.pop('date'))
+
+    compacted = [vendor_code for vendor_code in vendor_codes if vendor_code not in found]
+    if compacted:
+        buckets = PerformanceRollup.objects.filter(
+            vendor=OuterRef('pk'), resolution='hour', bucket_start__lte=as_of, last_at__lte=as_of,
+        ).order_by('-bucket_start')
+        rollups = PerformanceRollup.objects.filter(
+            pk__in=vendors.filter(pk__in=compacted).annotate(rollup_id=Subquery(buckets.values('id')[:1]))
+            .values('rollup_id'))
+        for rollup in rollups:
+            found[rollup.vendor_id] = dict(
+                {name: getattr(rollup, f'{name}_last') for name in METRIC_FIELDS}, recorded_at=rollup.last_at)
+    return found
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Vendor, PurchaseOrder, HistoricalPerformance
+from .models import Vendor, PurchaseOrder, PurchaseOrderItem, HistoricalPerformance, VendorRanking
 
 
 # This serilaizer is used to convert DB entries into json to view.
@@ -31,7 +31,93 @@ class PurchaseOrderSerializer(serializers.ModelSerializer):
             self.fields['po_number'].read_only = True
 
 
+# This serializer validates rows of a bulk purchase order import. The vendor is taken as a plain code and the
+# po_number uniqueness check is skipped, because the bulk action checks both for all rows with one query each.
+class PurchaseOrderBulkSerializer(serializers.ModelSerializer):
+    vendor = serializers.CharField(max_length=100)
+
+    class Meta:
+        model = PurchaseOrder
+        fields = '__all__'
+        extra_kwargs = {'po_number': {'validators': []}}
+
+
+# This serializer validates the list of purchase order numbers given to the batch acknowledge and complete actions.
+class PurchaseOrderNumbersSerializer(serializers.Serializer):
+    po_numbers = serializers.ListField(child=serializers.CharField(max_length=100), allow_empty=False)
+
+
 class HistoricalPerformanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = HistoricalPerformance
         fields = '__all__'
+
+
+# This serializer validates the filters of the async historical performance list, which match the viewset's.
+class HistoricalPerformanceQuerySerializer(serializers.Serializer):
+    vendor__vendor_code = serializers.CharField(max_length=100, required=False)
+    date__gte = serializers.DateTimeField(required=False)
+    date__lte = serializers.DateTimeField(required=False)
+
+
+# This serializer validates the cursor, filter and long-poll timeout of the historical performance change feed.
+class PerformanceFeedQuerySerializer(serializers.Serializer):
+    after = serializers.IntegerField(min_value=0, required=False, help_text="Last HistoricalPerformance id seen.")
+    vendor__vendor_code = serializers.CharField(max_length=100, required=False)
+    timeout = serializers.IntegerField(min_value=0, max_value=60, default=25,
+                                       help_text="Seconds a long-poll request waits for new snapshots.")
+
+
+# This serializer validates the query parameters of the historical performance series endpoint.
+class PerformanceSeriesQuerySerializer(serializers.Serializer):
+    vendor__vendor_code = serializers.CharField(max_length=100)
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    step = serializers.IntegerField(min_value=1, required=False, help_text="Wanted seconds between points.")
+    resolution = serializers.ChoiceField(choices=['hour', 'day', 'month'], required=False)
+
+
+# This serializer validates the optional point-in-time parameter of the vendor performance endpoints.
+class PerformanceAsOfSerializer(serializers.Serializer):
+    as_of = serializers.DateTimeField(required=False)
+
+
+# This serializer renders a leaderboard row, with the rank and percentile computed by the ranking endpoint.
+class VendorRankingSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='vendor.name', read_only=True)
+    rank = serializers.IntegerField(read_only=True)
+    percentile = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = VendorRanking
+        fields = ['vendor', 'name', 'rank', 'percentile', 'composite_score', *Vendor.METRIC_FIELDS]
+
+
+# This serializer validates the query parameters of the vendor ranking endpoint.
+class VendorRankingQuerySerializer(serializers.Serializer):
+    order_by = serializers.ChoiceField(choices=VendorRanking.RANKED_FIELDS, default='composite_score')
+    top = serializers.IntegerField(min_value=1, max_value=1000, required=False)
+    bottom = serializers.IntegerField(min_value=1, max_value=1000, required=False)
+
+    def validate(self, data):
+        if 'top' in data and 'bottom' in data:
+            raise serializers.ValidationError("Give either top or bottom, not both.")
+        return data
+
+
+# This serializer renders a purchase order line item together with the status of its order.
+class PurchaseOrderItemSerializer(serializers.ModelSerializer):
+    po_number = serializers.CharField(source='purchase_order_id', read_only=True)
+    status = serializers.CharField(source='purchase_order.status', read_only=True)
+
+    class Meta:
+        model = PurchaseOrderItem
+        fields = ['po_number', 'vendor', 'line', 'sku', 'quantity', 'status']
+
+
+# This serializer validates the filters of the line item endpoints. Lists need a sku and totals a sku or a vendor,
+# so that every query starts from one of the line item indexes.
+class PurchaseOrderItemQuerySerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=255, required=False)
+    vendor = serializers.CharField(max_length=100, required=False)
+    open = serializers.BooleanField(required=False, help_text="Only orders that are not Complete.")
@@ -1,22 +1,161 @@
-from django.db.models.signals import post_save, post_delete
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import PurchaseOrder
+from .models import Vendor, PurchaseOrder, PurchaseOrderItem, HistoricalPerformance, VendorMetricAccumulator, \
+    VendorRanking, DirtyVendor
+from .performance_cache import invalidate_performance, invalidate_ranking_total
+from .change_feed import change_feed
+
+
+# Returns how metric updates are applied ('sync', 'on_commit' or 'queue'), read per call so tests can override it
+def metrics_mode():
+    return getattr(settings, 'VENDOR_METRICS_MODE', 'sync')
+
+
+# Collects the vendors touched inside one transaction and recomputes each of them once when it commits
+class DirtyVendorBatch:
+    def __init__(self, using):
+        self.using = using
+        self.vendor_codes = set()
+
+    def __call__(self):
+        for vendor in Vendor.objects.using(self.using).filter(pk__in=self.vendor_codes):
+            with transaction.atomic(using=self.using):
+                vendor.refresh_metrics()
+
+
+# Marks a vendor as needing a metric recompute instead of recomputing it for every changed order
+def mark_vendor_dirty(vendor_code, using='default'):
+    if metrics_mode() == 'queue':
+        DirtyVendor.objects.using(using).bulk_create([DirtyVendor(vendor_id=vendor_code)], ignore_conflicts=True)
+        return
+    connection = transaction.get_connection(using)
+    batch = getattr(connection, 'dirty_vendor_batch', None)
+    # Reuse the batch of the current transaction unless it already ran or was discarded by a rollback
+    if connection.in_atomic_block and batch is not None \
+            and any(func is batch for _, func, _ in connection.run_on_commit):
+        batch.vendor_codes.add(vendor_code)
+        return
+    batch = DirtyVendorBatch(using)
+    batch.vendor_codes.add(vendor_code)
+    if connection.in_atomic_block:
+        connection.dirty_vendor_batch = batch
+    transaction.on_commit(batch, using=using)  # Runs straight away outside a transaction
+
+
+# Applies the difference between an order's old and new contributions to the accumulators of the affected vendors
+def apply_metric_change(instance, old, new, using='default'):
+    if metrics_mode() != 'sync':
+        for vendor_code in {snapshot[0] for snapshot in (old, new) if snapshot is not None}:
+            mark_vendor_dirty(vendor_code, using)
+        return
+    deltas = defaultdict(lambda: defaultdict(int))
+    for snapshot, sign in ((old, -1), (new, 1)):
+        if snapshot is None:
+            continue
+        vendor_code, contribution = snapshot
+        for name, value in contribution.items():
+            deltas[vendor_code][name] += sign * value
+    # Both vendors of a moved order change together; apply_metric_delta re-reads their stored metrics, so the
+    # order's cached vendor may be used even if it is stale
+    with transaction.atomic(using=using, savepoint=False):
+        for vendor_code, delta in deltas.items():
+            if not any(delta.values()):
+                continue
+            if vendor_code == instance.vendor_id:
+                vendor = instance.vendor
+            else:
+                vendor = Vendor.objects.using(using).filter(pk=vendor_code).first()
+            if vendor is not None:
+                vendor.apply_metric_delta(delta)
+
+
+@receiver(post_save, sender=Vendor)
+def create_metric_accumulator(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        VendorMetricAccumulator.objects.get_or_create(vendor=instance)
+
+
+@receiver(post_save, sender=Vendor)
+def refresh_vendor_ranking(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not set(update_fields) & set(Vendor.METRIC_FIELDS)):
+        return
+    VendorRanking.refresh([instance])
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def invalidate_performance_cache(sender, instance, update_fields=None, using='default', **kwargs):
+    if update_fields is not None and not set(update_fields) & set(Vendor.METRIC_FIELDS):
+        return
+    # Drop the entry now and again on commit, so a read between the two cannot keep pre-commit metrics cached
+    vendor_codes = [instance.pk]
+    invalidate_performance(vendor_codes)
+    transaction.on_commit(lambda: invalidate_performance(vendor_codes), using=using)
+
+
+# A deleted vendor takes its ranking row with it
+@receiver(post_delete, sender=Vendor)
+def invalidate_vendor_ranking_total(sender, using='default', **kwargs):
+    invalidate_ranking_total()
+    transaction.on_commit(invalidate_ranking_total, using=using)
+
+
+# Announces snapshots recorded by save_historical_performance to the change feed once they are committed
+@receiver(post_save, sender=HistoricalPerformance)
+def announce_performance_snapshot(sender, instance, created, raw=False, using='default', **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: change_feed.notify(instance.pk), using=using)
+
+
+@receiver(pre_save, sender=PurchaseOrder)
+def capture_metric_snapshot(sender, instance, raw=False, using='default', **kwargs):
+    # Orders loaded from the database already carry their snapshot; look it up for any other order with a po_number,
+    # since saving an unloaded PurchaseOrder(po_number=<existing>) updates the stored row although _state.adding
+    if raw or hasattr(instance, '_metric_snapshot'):
+        return
+    stored = None
+    if instance.pk is not None:
+        stored = PurchaseOrder.objects.using(using).filter(pk=instance.pk).first()
+    instance._metric_snapshot = stored.metric_snapshot() if stored else None
+
+
+@receiver(post_save, sender=PurchaseOrder)
+def update_vendor_metrics_on_save(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    # Only the difference between the stored and the saved order is applied, so the cost does not grow with the vendor
+    new = instance.metric_snapshot()
+    apply_metric_change(instance, getattr(instance, '_metric_snapshot', None), new, using)
+    instance._metric_snapshot = new
+
 
 @receiver(post_save, sender=PurchaseOrder)
-def update_vendor_metrics_on_save(sender, instance, **kwargs):
-    # Trigger updates based on the status of the order or if it's acknowledged
-    if instance.status == 'Complete':
-        instance.vendor.update_on_time_delivery_rate()
-        instance.vendor.update_quality_rating_avg()
-    if instance.acknowledgment_date:
-        instance.vendor.update_average_response_time()
-    instance.vendor.update_fulfillment_rate()
+def sync_line_items(sender, instance, created, update_fields=None, raw=False, using='default', **kwargs):
+    # Fixtures carry their own line items
+    if raw or (update_fields is not None and not {'items', 'vendor'} & set(update_fields)):
+        return
+    # Orders loaded from the database carry the lines they were stored with, so only real changes rewrite them
+    new = instance.line_item_snapshot()
+    if created or new != getattr(instance, '_line_item_snapshot', None):
+        PurchaseOrderItem.sync([instance], using, replace=not created)
+    instance._line_item_snapshot = new
+
+
+# Tells whether a delete was started from the vendor side, in which case the order's vendor is going away too
+def deleting_vendor(origin):
+    if isinstance(origin, QuerySet):
+        return origin.model is Vendor
+    return isinstance(origin, Vendor)
+
 
 @receiver(post_delete, sender=PurchaseOrder)
-def update_vendor_metrics_on_delete(sender, instance, **kwargs):
+def update_vendor_metrics_on_delete(sender, instance, origin=None, using='default', **kwargs):
+    if deleting_vendor(origin):
+        return
     # Update metrics assuming the vendor still needs accurate metrics without this order
-    if instance.vendor:
-        instance.vendor.update_on_time_delivery_rate()
-        instance.vendor.update_quality_rating_avg()
-        instance.vendor.update_average_response_time()
-        instance.vendor.update_fulfillment_rate()
\ No newline at end of file
+    old = getattr(instance, '_metric_snapshot', None) or instance.metric_snapshot()
+    apply_metric_change(instance, old, None, using)
@@ -1,3 +1,1250 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections, transaction
+from django.http import HttpResponse
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+from django.utils import timezone
+
+from .models import Vendor, PurchaseOrder, PurchaseOrderItem, HistoricalPerformance, VendorMetricAccumulator, DirtyVendor, \
+    PerformanceRollup, VendorRanking
+from .signals import DirtyVendorBatch
+from .instrumentation import registry
+from .database import ReadYourWritesMiddleware
+from .performance_cache import invalidate_performance
+from .fast_serialization import row_converter
+from .serializer import PurchaseOrderSerializer, VendorRankingSerializer
+from .authentication import CachedTokenAuthentication, token_cache, shared_token_cache, shared_key
+from .change_feed import ChangeFeed, change_feed
+
+
+# Shared helpers for creating vendors and purchase orders in tests.
+class VendorTestMixin:
+    def make_vendor(self, code='V1'):
+        return Vendor.objects.create(vendor_code=code, name='Vendor ' + code, contact_details='-', address='-')
+
+    def make_order(self, vendor, po_number, **fields):
+        now = timezone.now()
+        values = {
+            'items': [{'sku': 'A', 'qty': 1}],
+            'quantity': 1,
+            'order_date': now - timedelta(days=5),
+            'expected_delivery_date': now + timedelta(days=5),
+            'issue_date': now - timedelta(days=5),
+        }
+        values.update(fields)
+        return PurchaseOrder.objects.create(po_number=po_number, vendor=vendor, **values)
+
+
+class VendorMetricAccumulatorTests(VendorTestMixin, TestCase):
+    def setUp(self):
+        self.vendor = self.make_vendor()
+
+    def assert_accumulator_matches_recount(self, vendor):
+        accumulator = VendorMetricAccumulator.objects.get(vendor=vendor)
+        expected = VendorMetricAccumulator.recount(vendor)
+        for name, value in expected.items():
+            self.assertAlmostEqual(getattr(accumulator, name), value, msg=name)
+
+    def test_accumulator_created_with_vendor(self):
+        self.assertTrue(VendorMetricAccumulator.objects.filter(vendor=self.vendor).exists())
+
+    def test_deltas_track_acknowledge_complete_and_delete(self):
+        order = self.make_order(self.vendor, 'PO1')
+        other = self.make_order(self.vendor, 'PO2')
+        order = PurchaseOrder.objects.get(pk='PO1')
+        order.acknowledgment_date = order.issue_date + timedelta(hours=2)
+        order.save()
+        order.status = 'Complete'
+        order.quality_rating = 4.0
+        order.final_delivery_date = timezone.now()
+        order.save()
+        self.assert_accumulator_matches_recount(self.vendor)
+
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.on_time_delivery_rate, 100)
+        self.assertEqual(self.vendor.quality_rating_avg, 4.0)
+        self.assertAlmostEqual(self.vendor.average_response_time, 2.0)
+        self.assertEqual(self.vendor.fulfillment_rate, 50)
+
+        other.delete()
+        self.assert_accumulator_matches_recount(self.vendor)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.fulfillment_rate, 100)
+
+    def test_moving_order_between_vendors(self):
+        second = self.make_vendor('V2')
+        order = self.make_order(self.vendor, 'PO1', quality_rating=3.0)
+        order.vendor = second
+        order.save()
+        self.assert_accumulator_matches_recount(self.vendor)
+        self.assert_accumulator_matches_recount(second)
+
+    def test_delta_is_compared_with_the_stored_metrics_not_a_stale_vendor(self):
+        self.make_order(self.vendor, 'PO1', quality_rating=4.0)
+        self.make_order(self.vendor, 'PO2')
+        order = PurchaseOrder.objects.select_related('vendor').get(pk='PO2')
+        self.assertEqual(order.vendor.quality_rating_avg, 4.0)
+        # Another request lowers the average to 2 while this order's vendor still says 4
+        other = PurchaseOrder.objects.get(pk='PO1')
+        other.quality_rating = 2.0
+        other.save()
+        # (2 + 6) / 2 equals the stale value, which must not stop the write
+        order.quality_rating = 6.0
+        order.save()
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 4.0)
+
+    def test_saving_an_unloaded_existing_order_replaces_its_contribution(self):
+        self.make_order(self.vendor, 'PO1')
+        order = PurchaseOrder(po_number='PO1', vendor=self.vendor, items=[], quantity=1, status='Complete',
+                              quality_rating=5.0, order_date=timezone.now(), expected_delivery_date=timezone.now(),
+                              final_delivery_date=timezone.now(), issue_date=timezone.now())
+        self.assertTrue(order._state.adding)
+        order.save()
+        self.assertEqual(PurchaseOrder.objects.count(), 1)
+        self.assert_accumulator_matches_recount(self.vendor)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.fulfillment_rate, 100)
+        call_command('verify_vendor_metrics', stdout=StringIO())
+
+    def test_save_without_metric_change_writes_nothing(self):
+        order = self.make_order(self.vendor, 'PO1')
+        history_count = HistoricalPerformance.objects.count()
+        order.quantity = 7
+        with self.assertNumQueries(1):  # Only the UPDATE of the order itself
+            order.save()
+        self.assertEqual(HistoricalPerformance.objects.count(), history_count)
+
+    def test_vendor_delete_cascades_without_metric_writes(self):
+        self.make_order(self.vendor, 'PO1', quality_rating=3.0)
+        self.vendor.delete()
+        self.assertFalse(Vendor.objects.exists())
+        self.assertFalse(HistoricalPerformance.objects.exists())
+
+    def test_verify_command_detects_and_fixes_drift(self):
+        self.make_order(self.vendor, 'PO1', status='Complete', quality_rating=5.0, final_delivery_date=timezone.now())
+        VendorMetricAccumulator.objects.filter(vendor=self.vendor).update(total_orders=10)
+        with self.assertRaises(CommandError):
+            call_command('verify_vendor_metrics', stdout=StringIO())
+        call_command('verify_vendor_metrics', '--fix', stdout=StringIO())
+        call_command('verify_vendor_metrics', stdout=StringIO())
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.fulfillment_rate, 100)
+
+    def test_complete_writes_vendor_and_history_once(self):
+        order = self.make_order(self.vendor, 'PO1', acknowledgment_date=timezone.now())
+        history_count = HistoricalPerformance.objects.count()
+        order.status = 'Complete'
+        order.quality_rating = 4.5
+        order.final_delivery_date = timezone.now()
+        # Order UPDATE, accumulator UPDATE and SELECT, one vendor UPDATE, one ranking upsert and one history INSERT
+        with self.assertNumQueries(6):
+            order.save()
+        self.assertEqual(HistoricalPerformance.objects.count(), history_count + 1)
+
+    def test_refresh_metrics_recomputes_in_one_pass(self):
+        self.make_order(self.vendor, 'PO1', status='Complete', quality_rating=2.0, final_delivery_date=timezone.now())
+        self.make_order(self.vendor, 'PO2', quality_rating=4.0)
+        Vendor.objects.filter(pk=self.vendor.pk).update(quality_rating_avg=0, fulfillment_rate=0)
+        VendorMetricAccumulator.objects.filter(vendor=self.vendor).delete()
+        vendor = Vendor.objects.get(pk=self.vendor.pk)
+        history_count = HistoricalPerformance.objects.count()
+
+        self.assertTrue(vendor.refresh_metrics())
+        self.assertEqual(HistoricalPerformance.objects.count(), history_count + 1)
+        self.assert_accumulator_matches_recount(vendor)
+        vendor.refresh_from_db()
+        self.assertEqual(vendor.quality_rating_avg, 3.0)
+        self.assertEqual(vendor.fulfillment_rate, 50)
+        self.assertFalse(vendor.refresh_metrics())
+
+
+# Runs outside a test transaction, so each save commits on its own as in production
+class MetricTransactionTests(VendorTestMixin, TransactionTestCase):
+    def test_failed_vendor_write_rolls_back_the_order_and_accumulator(self):
+        vendor = self.make_vendor()
+        order = self.make_order(vendor, 'PO1')
+        counters = VendorMetricAccumulator.recount(vendor)
+        order.quality_rating = 5.0
+        with mock.patch.object(Vendor, 'save_historical_performance', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                order.save()
+        self.assertIsNone(PurchaseOrder.objects.get(pk='PO1').quality_rating)
+        accumulator = VendorMetricAccumulator.objects.get(vendor=vendor)
+        self.assertEqual({name: getattr(accumulator, name) for name in counters}, counters)
+        self.assertEqual(Vendor.objects.get(pk='V1').quality_rating_avg, 0)
+
+
+class DeferredVendorMetricsTests(VendorTestMixin, TestCase):
+    def setUp(self):
+        self.vendor = self.make_vendor()
+
+    def make_rated_orders(self, count):
+        for number in range(count):
+            self.make_order(self.vendor, f'PO{number}', status='Complete', quality_rating=float(number + 1),
+                            final_delivery_date=timezone.now())
+
+    @override_settings(VENDOR_METRICS_MODE='on_commit')
+    def test_on_commit_mode_recomputes_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                self.make_rated_orders(3)
+                self.vendor.refresh_from_db()
+                self.assertEqual(self.vendor.quality_rating_avg, 0)
+        self.assertEqual(sum(isinstance(callback, DirtyVendorBatch) for callback in callbacks), 1)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 2.0)
+        self.assertEqual(HistoricalPerformance.objects.filter(vendor=self.vendor).count(), 1)
+
+    @override_settings(VENDOR_METRICS_MODE='on_commit')
+    def test_on_commit_mode_survives_rolled_back_savepoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        self.make_rated_orders(1)
+                        raise ValueError
+                except ValueError:
+                    pass
+                self.make_order(self.vendor, 'PO9', quality_rating=5.0)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 5.0)
+
+    @override_settings(VENDOR_METRICS_MODE='queue')
+    def test_queue_mode_marks_vendor_for_worker(self):
+        self.make_rated_orders(3)
+        self.assertEqual(list(DirtyVendor.objects.values_list('vendor_id', flat=True)), [self.vendor.pk])
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 0)
+
+        call_command('process_dirty_vendors', '--once', stdout=StringIO())
+        self.assertFalse(DirtyVendor.objects.exists())
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 2.0)
+        self.assertEqual(HistoricalPerformance.objects.filter(vendor=self.vendor).count(), 1)
+
+
+class PurchaseOrderBulkTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+
+    def order_row(self, po_number, vendor='V1', **fields):
+        row = {
+            'po_number': po_number, 'vendor': vendor, 'items': [{'sku': 'A'}], 'quantity': 2,
+            'order_date': '2024-05-01T10:00:00Z', 'expected_delivery_date': '2024-05-10T10:00:00Z',
+            'issue_date': '2024-05-01T10:00:00Z',
+        }
+        row.update(fields)
+        return row
+
+    def test_bulk_create_reports_each_row(self):
+        self.make_order(self.vendor, 'PO-OLD')
+        rows = [
+            self.order_row('PO1', quality_rating=4.0),
+            self.order_row('PO2', vendor='MISSING'),
+            self.order_row('PO-OLD'),
+            self.order_row('PO1'),
+            {'po_number': 'PO3'},
+            self.order_row('PO4', quality_rating=2.0),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/purchase_orders/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (2, 0, 4))
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['created', 'error', 'error', 'error', 'error', 'created'])
+        self.assertIn('vendor', response.data['results'][1]['errors'])
+        self.assertIn('quantity', response.data['results'][4]['errors'])
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 3.0)
+        self.assertEqual(HistoricalPerformance.objects.filter(vendor=self.vendor).count(), 1)
+
+    def test_bulk_upsert_from_ndjson(self):
+        self.make_order(self.vendor, 'PO1')
+        body = '\n'.join(json.dumps(row) for row in [self.order_row('PO1', quantity=9), self.order_row('PO2')])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/purchase_orders/bulk/?upsert=true', body,
+                                        content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual(PurchaseOrder.objects.get(pk='PO1').quantity, 9)
+        self.assertEqual(VendorMetricAccumulator.objects.get(vendor=self.vendor).total_orders, 2)
+
+    def test_bulk_rejects_non_list_body(self):
+        response = self.client.post('/api/purchase_orders/bulk/', {'po_number': 'PO1'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_complete_bulk_updates_matched_orders(self):
+        other = self.make_vendor('V2')
+        self.make_order(self.vendor, 'PO1', quality_rating=5.0)
+        self.make_order(self.vendor, 'PO2')
+        self.make_order(other, 'PO3', quality_rating=3.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/purchase_orders/complete-bulk/',
+                                        {'po_numbers': ['PO1', 'PO3', 'PO9', 'PO1']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'matched': ['PO1', 'PO3'], 'missing': ['PO9']})
+        self.assertEqual(PurchaseOrder.objects.filter(status='Complete').count(), 2)
+        self.vendor.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.vendor.on_time_delivery_rate, self.vendor.fulfillment_rate), (100, 50))
+        self.assertEqual(other.fulfillment_rate, 100)
+
+    def test_acknowledge_bulk_sets_acknowledgment_date(self):
+        self.make_order(self.vendor, 'PO1')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/purchase_orders/acknowledge-bulk/', {'po_numbers': ['PO1']},
+                                        format='json')
+        self.assertEqual(response.data['matched'], ['PO1'])
+        self.assertIsNotNone(PurchaseOrder.objects.get(pk='PO1').acknowledgment_date)
+        self.assertEqual(VendorMetricAccumulator.objects.get(vendor=self.vendor).acknowledged_orders, 1)
+        response = self.client.post('/api/purchase_orders/acknowledge-bulk/', {'po_numbers': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkDeleteTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendors = [self.make_vendor('V1'), self.make_vendor('V2')]
+        orders = [PurchaseOrder(po_number=f'PO{number}', vendor=self.vendors[number % 2], items=[], quantity=1,
+                                status='Complete', quality_rating=float(number % 5 + 1),
+                                order_date=timezone.now(), expected_delivery_date=timezone.now(),
+                                final_delivery_date=timezone.now(), issue_date=timezone.now())
+                  for number in range(400)]
+        PurchaseOrder.objects.bulk_create(orders)
+        for vendor in self.vendors:
+            vendor.refresh_metrics()
+
+    def test_vendor_delete_skips_per_order_signals(self):
+        history_count = HistoricalPerformance.objects.filter(vendor_id='V2').count()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete('/api/vendors/V1/')
+        self.assertEqual(response.status_code, 204)
+        self.assertLess(len(queries), 30)
+        self.assertFalse(PurchaseOrder.objects.filter(vendor_id='V1').exists())
+        self.assertFalse(HistoricalPerformance.objects.filter(vendor_id='V1').exists())
+        self.assertEqual(PurchaseOrder.objects.filter(vendor_id='V2').count(), 200)
+        self.assertEqual(HistoricalPerformance.objects.filter(vendor_id='V2').count(), history_count)
+
+    def test_order_bulk_delete_recomputes_each_vendor_once(self):
+        history_count = HistoricalPerformance.objects.count()
+        doomed = PurchaseOrder.objects.filter(quality_rating__lte=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            total, counts = doomed.bulk_delete(batch_size=50)
+        self.assertEqual((total, counts), (160, {'testapp.PurchaseOrder': 160}))
+        self.assertEqual(HistoricalPerformance.objects.count(), history_count + 2)
+        call_command('verify_vendor_metrics', stdout=StringIO())
+
+    @override_settings(VENDOR_METRICS_MODE='queue')
+    def test_order_bulk_delete_queues_vendors_in_queue_mode(self):
+        history_count = HistoricalPerformance.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            PurchaseOrder.objects.filter(vendor_id='V1', quality_rating__lte=2).bulk_delete()
+        self.assertEqual(HistoricalPerformance.objects.count(), history_count)
+        self.assertEqual(list(DirtyVendor.objects.values_list('vendor_id', flat=True)), ['V1'])
+
+    def test_delete_bulk_action_reports_missing_orders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/purchase_orders/delete-bulk/', {'po_numbers': ['PO0', 'PO1', 'PO9999']},
+                                        format='json')
+        self.assertEqual(response.data, {'deleted': ['PO0', 'PO1'], 'missing': ['PO9999']})
+        self.assertEqual(PurchaseOrder.objects.count(), 398)
+        call_command('verify_vendor_metrics', stdout=StringIO())
+
+    def test_history_delete_bulk_keeps_rows_outside_the_date_range(self):
+        HistoricalPerformance.objects.all().delete()
+        HistoricalPerformance.objects.bulk_create([
+            HistoricalPerformance(vendor=vendor, date=datetime(2024, month, 1, tzinfo=dt_timezone.utc),
+                                  on_time_delivery_rate=0, quality_rating_avg=0, average_response_time=0,
+                                  fulfillment_rate=0)
+            for vendor in self.vendors for month in (1, 2, 3, 4)])
+        response = self.client.delete('/api/historical_performance/delete-bulk/?vendor__vendor_code=V1'
+                                      '&date__gte=2024-02-01T00:00:00Z&date__lte=2024-03-01T00:00:00Z')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([row.month for row in HistoricalPerformance.objects.filter(vendor_id='V1')
+                          .order_by('date').values_list('date', flat=True)], [1, 4])
+        self.assertEqual(HistoricalPerformance.objects.filter(vendor_id='V2').count(), 4)
+        response = self.client.delete('/api/historical_performance/delete-bulk/?vendor__vendor_code=V1'
+                                      '&date__gte=yesterday')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(HistoricalPerformance.objects.count(), 6)
+
+
+class PurchaseOrderItemTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        other = self.make_vendor('V2')
+        self.make_order(self.vendor, 'PO1', items=[{'sku': 'A', 'qty': 3}, {'sku': 'B', 'qty': 1}])
+        self.make_order(self.vendor, 'PO2', items=[{'sku': 'A', 'qty': 2}], status='Complete')
+        self.make_order(other, 'PO3', items=[{'item_name': 'A'}, 'C'])
+
+    def lines(self, po_number):
+        return list(PurchaseOrderItem.objects.filter(purchase_order=po_number).order_by('line')
+                    .values_list('vendor', 'sku', 'quantity'))
+
+    def test_loaded_fixtures_keep_their_own_line_items(self):
+        fixture = serializers.serialize('json', PurchaseOrder.objects.filter(pk='PO1'))
+        PurchaseOrderItem.objects.filter(purchase_order='PO1').update(sku='FIXTURE')
+        for obj in serializers.deserialize('json', fixture.replace('"sku": "B"', '"sku": "Z"')):
+            obj.save()
+        self.assertEqual(self.lines('PO1'), [('V1', 'FIXTURE', 3), ('V1', 'FIXTURE', 1)])
+
+    def test_lines_are_parsed_from_items(self):
+        self.assertEqual(PurchaseOrderItem.lines_from([{'sku': 'A', 'qty': 2}, {'item_name': 'B', 'quantity': 4},
+                                                       'C', 7, {'description': 'no sku'}, None, {'sku': 'D'}]),
+                         (('A', 2), ('B', 4), ('C', 1), ('7', 1), ('D', 1)))
+        self.assertEqual(PurchaseOrderItem.lines_from({'sku': 'A'}), (('A', 1),))
+        self.assertEqual(PurchaseOrderItem.lines_from('A'), ())
+
+    def test_lines_follow_order_changes(self):
+        self.assertEqual(self.lines('PO3'), [('V2', 'A', 1), ('V2', 'C', 1)])
+        response = self.client.patch('/api/purchase_orders/PO1/', {'items': [{'sku': 'B', 'qty': 5}], 'vendor': 'V2'},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines('PO1'), [('V2', 'B', 5)])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/purchase_orders/PO1/acknowledge/')
+        self.assertFalse(any('testapp_purchaseorderitem' in query['sql'] for query in queries.captured_queries))
+        PurchaseOrder.objects.get(pk='PO1').delete()
+        self.assertEqual(self.lines('PO1'), [])
+        PurchaseOrder.objects.filter(pk='PO2').bulk_delete()
+        self.assertEqual(self.lines('PO2'), [])
+
+    def test_bulk_upsert_rewrites_lines(self):
+        row = {'po_number': 'PO3', 'vendor': 'V1', 'items': [{'sku': 'Z', 'qty': 9}], 'quantity': 1,
+               'order_date': '2024-05-01T10:00:00Z', 'expected_delivery_date': '2024-05-10T10:00:00Z',
+               'issue_date': '2024-05-01T10:00:00Z'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/purchase_orders/bulk/?upsert=true', [row, dict(row, po_number='PO4')],
+                             format='json')
+        self.assertEqual(self.lines('PO3'), [('V1', 'Z', 9)])
+        self.assertEqual(self.lines('PO4'), [('V1', 'Z', 9)])
+
+    def test_list_and_totals_by_sku_and_vendor(self):
+        response = self.client.get('/api/line_items/?sku=A&open=true')
+        self.assertEqual([(row['po_number'], row['vendor'], row['quantity'], row['status'])
+                          for row in response.data['results']], [('PO1', 'V1', 3, None), ('PO3', 'V2', 1, None)])
+        self.assertEqual(self.client.get('/api/line_items/totals/?sku=A').data, [
+            {'vendor': 'V1', 'sku': 'A', 'lines': 2, 'quantity': 5},
+            {'vendor': 'V2', 'sku': 'A', 'lines': 1, 'quantity': 1},
+        ])
+        self.assertEqual(self.client.get('/api/line_items/totals/?vendor=V1&open=1').data, [
+            {'vendor': 'V1', 'sku': 'A', 'lines': 1, 'quantity': 3},
+            {'vendor': 'V1', 'sku': 'B', 'lines': 1, 'quantity': 1},
+        ])
+        self.assertEqual(self.client.get('/api/line_items/?vendor=V1').status_code, 400)
+        self.assertEqual(self.client.get('/api/line_items/totals/').status_code, 400)
+
+
+class KeysetPaginationTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        for number in range(5):
+            self.make_order(self.vendor, f'PO{number}', quality_rating=float(number + 1))
+
+    def collect_pages(self, url):
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_purchase_orders_are_paged_by_po_number(self):
+        orders = self.collect_pages('/api/purchase_orders/?page_size=2&vendor__vendor_code=V1')
+        self.assertEqual([order['po_number'] for order in orders], [f'PO{number}' for number in range(5)])
+
+    def test_history_is_paged_by_id(self):
+        history = self.collect_pages('/api/historical_performance/?page_size=2')
+        self.assertEqual([row['id'] for row in history],
+                         list(HistoricalPerformance.objects.order_by('id').values_list('id', flat=True)))
+
+    @override_settings(API_PAGE_SIZE=2, API_MAX_PAGE_SIZE=3)
+    def test_page_size_settings_are_read_per_request(self):
+        self.assertEqual(len(self.client.get('/api/purchase_orders/').data['results']), 2)
+        self.assertEqual(len(self.client.get('/api/purchase_orders/?page_size=5').data['results']), 3)
+
+
+class FastListSerializationTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        vendor = self.make_vendor()
+        self.make_vendor('V\u2028\u00e9')
+        vendor.name = 'Vendor "1" \u2029 \u00fcber'
+        vendor.on_time_delivery_rate = 1e-05
+        vendor.save()
+        for number in range(5):
+            self.make_order(vendor, f'PO{number}', items={'sku': 'A', 'note': '\u2028'} if number else [],
+                            quality_rating=number / 3 if number % 2 else None, status='Complete' if number else None,
+                            final_delivery_date=timezone.now() if number % 2 else None)
+
+    def assert_same_bytes(self, url, **headers):
+        fast = self.client.get(url, **headers)
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            slow = self.client.get(url, **headers)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_lists_render_the_same_bytes(self):
+        for url in ('/api/vendors/', '/api/purchase_orders/?page_size=2', '/api/purchase_orders/?vendor__vendor_code=V1',
+                    '/api/historical_performance/?vendor__vendor_code=V1&page_size=3'):
+            with self.subTest(url=url):
+                response = self.assert_same_bytes(url)
+                if 'next' in response.json() and response.json()['next']:
+                    self.assert_same_bytes(response.json()['next'])
+        self.assertIn(b'"V\\u2028\xc3\xa9"', self.assert_same_bytes('/api/vendors/').content)
+        self.assert_same_bytes('/api/purchase_orders/', HTTP_ACCEPT='application/json; indent=4')
+        with timezone.override('UTC'):
+            self.assert_same_bytes('/api/historical_performance/')
+
+    def test_serializers_with_computed_fields_have_no_fast_path(self):
+        self.assertIsNone(row_converter(VendorRankingSerializer))
+        self.assertEqual(row_converter(PurchaseOrderSerializer).columns[:3], ['po_number', 'vendor_id', 'items'])
+
+
+class ExportTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        other = self.make_vendor('V2')
+        for number in range(3):
+            self.make_order(self.vendor, f'PO{number}', quality_rating=float(number + 1))
+        self.make_order(other, 'PO9', quality_rating=1.0)
+
+    def read_stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_history_ndjson_matches_list_and_filters(self):
+        url = '/api/historical_performance/?vendor__vendor_code=V1'
+        listed = self.client.get(url + '&page_size=1000').json()['results']
+        response, body = self.read_stream(url.replace('/?', '/export/ndjson/?'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in body.splitlines()], listed)
+
+        newest = HistoricalPerformance.objects.filter(vendor=self.vendor).latest('id')
+        _, body = self.read_stream('/api/historical_performance/export/ndjson/?vendor__vendor_code=V1&date__gte='
+                                   + newest.date.isoformat().replace('+', '%2B'))
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [newest.id])
+
+    def test_purchase_order_csv_export(self):
+        response, body = self.read_stream('/api/purchase_orders/export/csv/?vendor__vendor_code=V1')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['po_number', 'vendor'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['PO0', 'PO1', 'PO2'])
+
+
+class PerformanceRollupTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        now = timezone.now()
+        # Four snapshots a day for the last 60 days, with a quality rating that rises over time
+        for index in range(240):
+            HistoricalPerformance.objects.create(
+                vendor=self.vendor, date=now - timedelta(hours=6 * (240 - index)), on_time_delivery_rate=100,
+                quality_rating_avg=float(index), average_response_time=1, fulfillment_rate=50)
+
+    def test_compaction_rolls_up_and_deletes_old_snapshots(self):
+        call_command('compact_historical_performance', '--retention-days', '30', stdout=StringIO())
+        cutoff = timezone.now() - timedelta(days=31)
+        self.assertFalse(HistoricalPerformance.objects.filter(date__lt=cutoff).exists())
+        self.assertTrue(HistoricalPerformance.objects.exists())
+        hourly = PerformanceRollup.objects.filter(resolution='hour')
+        self.assertEqual(sum(hourly.values_list('samples', flat=True)),
+                         240 - HistoricalPerformance.objects.count())
+        first = hourly.order_by('bucket_start').first()
+        self.assertEqual((first.quality_rating_avg_min, first.quality_rating_avg_last), (0, 0))
+
+        # Compacting again later folds the new snapshots into the existing daily and monthly buckets
+        call_command('compact_historical_performance', '--retention-days', '0', stdout=StringIO())
+        self.assertFalse(HistoricalPerformance.objects.exists())
+        for resolution in ('hour', 'day', 'month'):
+            rollups = PerformanceRollup.objects.filter(resolution=resolution)
+            self.assertEqual(sum(rollups.values_list('samples', flat=True)), 240, resolution)
+        latest = PerformanceRollup.objects.filter(resolution='month').latest('bucket_start')
+        self.assertEqual(latest.quality_rating_avg_last, 239)
+
+    def test_series_picks_coarsest_resolution_and_merges_raw_tail(self):
+        call_command('compact_historical_performance', '--retention-days', '30', stdout=StringIO())
+        response = self.client.get('/api/historical_performance/series/', {'vendor__vendor_code': 'V1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['resolution'], 'day')
+        buckets = response.data['buckets']
+        self.assertEqual(sum(bucket['samples'] for bucket in buckets), 240)
+        self.assertLessEqual(len(buckets), 62)
+        self.assertEqual(buckets[-1]['quality_rating_avg']['last'], 239)
+        self.assertEqual(buckets[0]['quality_rating_avg']['min'], 0)
+
+        response = self.client.get('/api/historical_performance/series/',
+                                   {'vendor__vendor_code': 'V1', 'step': 3600 * 6})
+        self.assertEqual(response.data['resolution'], 'hour')
+        response = self.client.get('/api/historical_performance/series/', {'vendor__vendor_code': 'V1', 'step': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class PerformanceAsOfTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.now = timezone.now()
+        for code in ('V1', 'V2'):
+            vendor = self.make_vendor(code)
+            # One snapshot a day for the last 60 days, whose quality rating is its age in days
+            for days in range(60, 0, -1):
+                HistoricalPerformance.objects.create(
+                    vendor=vendor, date=self.now - timedelta(days=days), on_time_delivery_rate=100,
+                    quality_rating_avg=float(days), average_response_time=1, fulfillment_rate=50)
+
+    def as_of(self, days):
+        return (self.now - timedelta(days=days, hours=1)).isoformat().replace('+00:00', 'Z')
+
+    def test_single_vendor_as_of(self):
+        response = self.client.get('/api/vendors/V1/performance/?as_of=' + self.as_of(10))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['quality_rating_avg'], 11.0)
+        self.assertEqual(self.client.get('/api/vendors/V1/performance/?as_of=' + self.as_of(61)).status_code, 404)
+        self.assertEqual(self.client.get('/api/vendors/V9/performance/?as_of=' + self.as_of(10)).status_code, 404)
+        self.assertEqual(self.client.get('/api/vendors/V1/performance/?as_of=yesterday').status_code, 400)
+
+    def test_many_vendors_as_of_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = self.client.post('/api/vendors/performance-bulk/',
+                                    {'vendor_codes': ['V1', 'V2'], 'as_of': self.as_of(20)}, format='json')
+        self.assertEqual({code: metrics['quality_rating_avg'] for code, metrics in rows.data['vendors'].items()},
+                         {'V1': 21.0, 'V2': 21.0})
+
+    def test_as_of_falls_back_to_rollups_after_compaction(self):
+        call_command('compact_historical_performance', '--retention-days', '30', stdout=StringIO())
+        response = self.client.get('/api/vendors/performance-bulk/?vendor_codes=V1,V2,V9&as_of=' + self.as_of(40))
+        self.assertEqual(response.data['vendors']['V2']['quality_rating_avg'], 41.0)
+        self.assertEqual(response.data['missing'], ['V9'])
+
+    def test_as_of_seeks_the_vendor_date_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/vendors/performance-bulk/?vendor_codes=V1,V2&as_of=' + self.as_of(20))
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[-1]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('hp_vendor_date_idx (vendor_id=? AND date<?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class VendorPerformanceCacheTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        self.make_order(self.vendor, 'PO1', quality_rating=4.0)
+
+    def test_cached_performance_with_conditional_get(self):
+        response = self.client.get('/api/vendors/V1/performance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['quality_rating_avg'], 4.0)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/vendors/V1/performance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/vendors/V1/performance/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # Writing the vendor's metrics invalidates the cached entry
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_order(self.vendor, 'PO2', quality_rating=2.0)
+        response = self.client.get('/api/vendors/V1/performance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['quality_rating_avg'], 3.0)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unknown_vendor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/vendors/NOPE/performance/').status_code, 404)
+
+    def test_performance_bulk(self):
+        self.make_vendor('V2')
+        response = self.client.get('/api/vendors/performance-bulk/?vendor_codes=V1,V2,NOPE')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['vendors']), {'V1', 'V2'})
+        self.assertEqual(response.data['vendors']['V1']['quality_rating_avg'], 4.0)
+        self.assertEqual(response.data['missing'], ['NOPE'])
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/vendors/performance-bulk/', {'vendor_codes': ['V1', 'V2']},
+                                        format='json')
+        self.assertEqual(len(response.data['vendors']), 2)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_benchmark_reports_every_scenario(self):
+        output = StringIO()
+        call_command('benchmark_api', '--in-place', '--vendors', '3', '--orders', '30', '--requests', '3',
+                     stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report['scenarios']), {
+            'po_create', 'acknowledge', 'complete', 'performance', 'list_purchase_orders',
+            'list_historical_performance', 'vendor_delete'})
+        for name, result in report['scenarios'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_serialization_benchmark_fails_on_error_responses(self):
+        with mock.patch('testapp.management.commands.benchmark_serialization.ENDPOINTS', {'missing': 'missing/'}):
+            with self.assertRaisesMessage(CommandError, 'missing (serializer): 2 of 2 request(s) failed'):
+                call_command('benchmark_serialization', '--in-place', '--vendors', '2', '--orders', '4',
+                             '--history', '4', '--requests', '2', stdout=StringIO())
+
+    # Outside the test runner ALLOWED_HOSTS lacks the test client's host, and the database keeps earlier runs' data
+    @override_settings(ALLOWED_HOSTS=['api.example.com'])
+    def test_in_place_benchmark_runs_twice_on_the_same_database(self):
+        for _ in range(2):
+            output = StringIO()
+            call_command('benchmark_api', '--in-place', '--vendors', '2', '--orders', '10', '--requests', '2',
+                         stdout=output)
+            for name, result in json.loads(output.getvalue())['scenarios'].items():
+                self.assertEqual(result['errors'], 0, name)
+
+    def test_serialization_benchmark_reports_identical_responses(self):
+        output = StringIO()
+        call_command('benchmark_serialization', '--in-place', '--vendors', '3', '--orders', '20', '--history', '30',
+                     '--requests', '2', stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report['endpoints']), {
+            'list_vendors', 'list_purchase_orders', 'list_historical_performance'})
+        for name, result in report['endpoints'].items():
+            self.assertTrue(result['identical'], name)
+            self.assertEqual(result['fast']['errors'], 0, name)
+            self.assertGreater(result['rows_per_page'], 0, name)
+
+
+# The ASGI requests run on their own threads and connections, so the generated data must be committed
+class AsyncBenchmarkCommandTests(TransactionTestCase):
+    def test_async_benchmark_compares_modes_per_concurrency(self):
+        output = StringIO()
+        call_command('benchmark_async', '--in-place', '--vendors', '2', '--orders', '10', '--requests', '4',
+                     '--concurrency', '1,4', stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report['endpoints']), {
+            'vendor_detail', 'performance', 'list_purchase_orders', 'list_historical_performance'})
+        for name, modes in report['endpoints'].items():
+            for mode in ('sync', 'async'):
+                for level in ('1', '4'):
+                    self.assertEqual(modes[mode][level]['requests'], 4)
+                    self.assertEqual(modes[mode][level]['errors'], 0, f'{name} {mode} {level}')
+
+
+class RequestMetricsTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        registry.reset()
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        self.make_order(self.vendor, 'PO1', quality_rating=4.0)
+
+    def test_metrics_endpoint_reports_views_and_vendor_updates(self):
+        self.client.post('/api/purchase_orders/PO1/complete/')
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="PurchaseOrderViewSet.complete",status="200"} 1', body)
+        self.assertIn('db_queries_per_request_count{view="PurchaseOrderViewSet.complete"} 1', body)
+        self.assertIn('vendor_update_duration_seconds_count{view="PurchaseOrderViewSet.complete",'
+                      'method="apply_metric_delta"} 1', body)
+
+    def test_metrics_endpoint_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get('/api/metrics').status_code, (401, 403))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('testapp.requests', 'WARNING') as logs:
+            self.client.get('/api/vendors/V1/')
+        self.assertIn('VendorViewSet.retrieve', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class AsyncReadViewTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create_user('tester')
+        key = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        self.token_header = {'Authorization': f'Token {key}'}
+        vendor = self.make_vendor()
+        for number in range(5):
+            self.make_order(vendor, f'PO{number}', status='Complete', quality_rating=4.0,
+                            final_delivery_date=timezone.now(), acknowledgment_date=timezone.now())
+
+    # AsyncClient drops headers given to its constructor, so the token is passed with every request
+    def aget(self, path, **headers):
+        return AsyncClient().get(path, headers={**self.token_header, **headers})
+
+    async def test_async_views_match_sync_views(self):
+        for path in ('vendors/V1/', 'vendors/V1/performance/', 'purchase_orders/?vendor__vendor_code=V1',
+                     'historical_performance/?vendor__vendor_code=V1&page_size=2', 'vendors/V9/'):
+            with self.subTest(path=path):
+                response = await self.aget('/api/async/' + path)
+                expected = await sync_to_async(self.client.get)('/api/' + path)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(json.loads(response.content.replace(b'/api/async/', b'/api/')),
+                                 json.loads(expected.content))
+
+    async def test_cursors_work_across_sync_and_async_lists(self):
+        first = (await self.aget('/api/async/purchase_orders/?page_size=2')).json()
+        self.assertEqual([order['po_number'] for order in first['results']], ['PO0', 'PO1'])
+        second = (await sync_to_async(self.client.get)(first['next'].replace('/api/async/', '/api/'))).json()
+        self.assertEqual([order['po_number'] for order in second['results']], ['PO2', 'PO3'])
+        back = (await self.aget(second['previous'].replace('/api/', '/api/async/'))).json()
+        self.assertEqual([order['po_number'] for order in back['results']], ['PO0', 'PO1'])
+        self.assertIsNone(back['previous'])
+
+    async def test_performance_etag_and_authentication(self):
+        response = await self.aget('/api/async/vendors/V1/performance/')
+        cached = await self.aget('/api/async/vendors/V1/performance/', **{'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual((await AsyncClient().get('/api/async/vendors/V1/')).status_code, 403)
+        bad_token = await AsyncClient().get('/api/async/vendors/V1/', headers={'Authorization': 'Token nope'})
+        self.assertEqual(bad_token.json(), {'detail': 'Invalid token.'})
+        session = AsyncClient()
+        await session.aforce_login(self.user)
+        self.assertEqual((await session.get('/api/async/vendors/V1/')).status_code, 200)
+        self.assertEqual((await session.post('/api/async/vendors/V1/')).status_code, 405)
+
+    async def test_async_requests_are_instrumented(self):
+        await self.aget('/api/async/purchase_orders/')
+        body = registry.render()
+        self.assertIn('http_requests_total{view="testapp.async_views.purchase_order_list",status="200"} 1', body)
+        self.assertNotIn('db_queries_per_request_sum{view="testapp.async_views.purchase_order_list"} 0', body)
+
+
+class PerformanceFeedTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        # Ids are reused after each test's rollback, so the feed must not keep rows from earlier tests
+        change_feed.clear()
+        self.addCleanup(change_feed.clear)
+        self.user = User.objects.create_user('tester')
+        self.headers = {'Authorization': f'Token {Token.objects.get(user=self.user).key}'}
+        self.vendor = self.make_vendor()
+        self.other = self.make_vendor('V2')
+        self.vendor.save_historical_performance()
+        self.other.save_historical_performance()
+        self.first_id = HistoricalPerformance.objects.get(vendor=self.vendor).id
+
+    def feed(self, query='', **headers):
+        return AsyncClient().get('/api/async/historical_performance/feed/' + query,
+                                 headers={**self.headers, **headers})
+
+    async def test_long_poll_returns_rows_after_the_cursor(self):
+        response = await self.feed(f'?after={self.first_id - 1}&vendor__vendor_code=V1')
+        self.assertEqual(response.json()['cursor'], self.first_id)
+        self.assertEqual([row['vendor'] for row in response.json()['results']], ['V1'])
+        empty = (await self.feed('?timeout=0')).json()
+        self.assertEqual(empty, {'cursor': self.first_id + 1, 'results': []})
+        self.assertEqual((await AsyncClient().get('/api/async/historical_performance/feed/')).status_code, 403)
+
+    async def test_long_poll_waits_for_announced_snapshots(self):
+        waiting = asyncio.ensure_future(self.feed(f'?after={self.first_id + 1}&vendor__vendor_code=V1&timeout=5'))
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiting.done())
+        # A snapshot of another vendor wakes the poll without answering it
+        await sync_to_async(self.other.save_historical_performance)()
+        change_feed.notify(self.first_id + 2)
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiting.done())
+        await sync_to_async(self.vendor.save_historical_performance)()
+        change_feed.notify(self.first_id + 3)
+        response = await asyncio.wait_for(waiting, 1)
+        self.assertEqual(response.json()['cursor'], self.first_id + 3)
+
+    async def test_event_stream_resumes_from_last_event_id(self):
+        response = await self.feed(**{'Accept': 'text/event-stream', 'Last-Event-ID': str(self.first_id)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        event = (await anext(events)).decode()
+        self.assertTrue(event.startswith(f'id: {self.first_id + 1}\nevent: performance\ndata: '))
+        self.assertEqual(json.loads(event.split('data: ')[1])['vendor'], 'V2')
+        await events.aclose()
+
+    @override_settings(CHANGE_FEED_POLL_INTERVAL=0.01)
+    async def test_wait_finds_rows_written_by_other_processes(self):
+        feed = ChangeFeed()
+        self.assertEqual(await feed.wait(self.first_id, 1), self.first_id + 1)
+        self.assertIsNone(await feed.wait(self.first_id + 1, 0.05))
+
+    def test_subscribers_at_the_head_share_one_read(self):
+        feed = ChangeFeed()
+        self.assertEqual(async_to_sync(feed.rows_after)(self.first_id + 1), [])
+        self.vendor.save_historical_performance()
+        self.other.save_historical_performance()
+        feed.notify(self.first_id + 3)
+
+        async def subscribers():
+            return await asyncio.gather(*(feed.rows_after(self.first_id + 1, vendor_code)
+                                          for vendor_code in ('V1', 'V2', None) * 10))
+        with CaptureQueriesContext(connection) as queries:
+            results = async_to_sync(subscribers)()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([row.vendor_id for row in results[0]], ['V1'])
+        self.assertEqual([row.vendor_id for row in results[2]], ['V1', 'V2'])
+        # A cursor older than the buffer is served from the database
+        self.assertEqual([row.vendor_id for row in async_to_sync(feed.rows_after)(0, 'V2')], ['V2', 'V2'])
+
+    def test_refill_reads_only_the_newest_rows_of_a_burst(self):
+        feed = ChangeFeed()
+        async_to_sync(feed.rows_after)(self.first_id + 1)
+        for _ in range(3):
+            self.vendor.save_historical_performance()
+            self.other.save_historical_performance()
+        feed.notify(self.first_id + 7)
+        with mock.patch('testapp.change_feed.BUFFER_SIZE', 4), CaptureQueriesContext(connection) as queries:
+            rows = async_to_sync(feed.rows_after)(self.first_id + 5)
+            self.assertEqual([row.id for row in feed.buffer], list(range(self.first_id + 4, self.first_id + 8)))
+            # The skipped rows are read from the database by the subscribers asking for them
+            behind = async_to_sync(feed.rows_after)(self.first_id + 1)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('LIMIT 4', queries[0]['sql'])
+        self.assertEqual([row.id for row in rows], [self.first_id + 6, self.first_id + 7])
+        self.assertEqual([row.id for row in behind], list(range(self.first_id + 2, self.first_id + 8)))
+
+    def test_committed_snapshots_are_announced(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendor.save_historical_performance()
+        self.assertEqual(change_feed.latest_id, HistoricalPerformance.objects.latest('id').id)
+
+
+class CachedTokenAuthenticationTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user('tester')
+        self.key = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.make_vendor()
+
+    # Queries of a performance poll; the metrics come from the performance cache once warm
+    def poll_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/vendors/V1/performance/').status_code, 200)
+        return len(queries)
+
+    def test_warm_requests_run_no_query(self):
+        self.poll_queries()
+        self.assertEqual(self.poll_queries(), 0)
+        with override_settings(AUTH_TOKEN_CACHE_TTL=0):
+            token_cache.clear()
+            self.assertEqual(self.poll_queries(), 1)
+            self.assertEqual(self.poll_queries(), 1)
+
+    def test_cached_user_is_rebuilt_without_its_password(self):
+        CachedTokenAuthentication().authenticate_credentials(self.key)
+        with self.assertNumQueries(0):
+            user, token = CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertEqual((user.pk, user.username, token.key), (self.user.pk, 'tester', self.key))
+        self.assertTrue(user.is_authenticated)
+        self.assertIn('password', user.get_deferred_fields())
+
+    def test_deactivated_user_and_deleted_token_are_rejected(self):
+        self.assertEqual(self.client.get('/api/vendors/V1/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/vendors/V1/').json(), {'detail': 'User inactive or deleted.'})
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/vendors/V1/').status_code, 200)
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.client.get('/api/vendors/V1/').json(), {'detail': 'Invalid token.'})
+
+    def test_rotated_token_is_rejected_through_the_shared_cache(self):
+        with override_settings(AUTH_TOKEN_SHARED_CACHE='default'):
+            self.poll_queries()
+            # The user's fields are shared, never the token or the password hash
+            entry = shared_token_cache().get(shared_key(self.key))
+            self.assertEqual((entry['id'], entry['is_active']), (self.user.pk, True))
+            self.assertNotIn('password', entry)
+            self.assertNotIn(self.key, repr(entry))
+            token_cache.clear()
+            self.assertEqual(self.poll_queries(), 0)
+            Token.objects.get(key=self.key).delete()
+            Token.objects.create(user=self.user)
+            self.assertIsNone(shared_token_cache().get(shared_key(self.key)))
+            self.assertEqual(self.client.get('/api/vendors/V1/').status_code, 403)
+
+    async def test_async_views_share_the_cache(self):
+        headers = {'Authorization': f'Token {self.key}'}
+        self.assertEqual((await AsyncClient().get('/api/async/vendors/V1/', headers=headers)).status_code, 200)
+        self.assertIsNotNone(token_cache.get(self.key))
+        await Token.objects.filter(key=self.key).adelete()
+        response = await AsyncClient().get('/api/async/vendors/V1/', headers=headers)
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+
+# Routes against two SQLite files: the test database as the primary and an empty, migrated file as the replica,
+# so whichever of them answered a read shows in its result
+class ReplicaRoutingTests(VendorTestMixin, APITransactionTestCase):
+    # Resolved when the class is set up, after the replica alias was added
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.directory.name, 'replica.db')}
+        connections.settings['replica'] = connections.configure_settings(
+            {'default': connections.settings['default'], 'replica': replica})['replica']
+        super().setUpClass()
+        call_command('migrate', database='replica', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.make_order(self.make_vendor(), 'PO1', status='Complete', final_delivery_date=timezone.now())
+
+    def test_lists_exports_and_history_read_the_replica(self):
+        self.assertEqual(self.client.get('/api/purchase_orders/').data['results'], [])
+        self.assertEqual(self.client.get('/api/historical_performance/').data['results'], [])
+        export = self.client.get('/api/purchase_orders/export/csv/')
+        self.assertEqual(len(b''.join(export.streaming_content).splitlines()), 1)
+        # Single objects are read from the primary
+        self.assertEqual(self.client.get('/api/purchase_orders/PO1/').status_code, 200)
+
+    def test_reads_stick_to_the_primary_after_a_write_in_the_same_request(self):
+        seen = []
+
+        def view(request):
+            seen.append(HistoricalPerformance.objects.count())
+            PurchaseOrder.objects.filter(pk='PO1').update(quality_rating=4.0)
+            seen.append(HistoricalPerformance.objects.count())
+            return HttpResponse()
+
+        ReadYourWritesMiddleware(view)(RequestFactory().get('/'))
+        ReadYourWritesMiddleware(view)(RequestFactory().get('/'))
+        primary_count = HistoricalPerformance.objects.using('default').count()
+        self.assertEqual(seen, [0, primary_count, 0, primary_count])
+
+    def test_cached_performance_takes_last_modified_from_the_primary(self):
+        invalidate_performance(['V1'])
+        response = self.client.get('/api/vendors/V1/performance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 2500})
+    def test_pragmas_are_applied_to_new_connections(self):
+        connections['replica'].close()
+        with connections['replica'].cursor() as cursor:
+            values = [cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                      for name in ('journal_mode', 'synchronous', 'busy_timeout')]
+        self.assertEqual(values, ['wal', 1, 2500])
+
+
+# Runs the real metric methods and list endpoints, then EXPLAINs every query they issued against the order and
+# history tables and fails if SQLite plans a full scan of either table.
+class QueryPlanTests(VendorTestMixin, APITestCase):
+    TABLES = ('testapp_purchaseorder', 'testapp_historicalperformance', 'testapp_purchaseorderitem')
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        self.vendor = self.make_vendor()
+        other = self.make_vendor('V2')
+        for number in range(20):
+            self.make_order(self.vendor if number % 2 else other, f'PO{number}', quality_rating=float(number % 5),
+                            acknowledgment_date=timezone.now() if number % 3 else None)
+
+    def assert_no_full_scans(self, queries):
+        steps = []
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(table in sql for table in self.TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                for table in self.TABLES:
+                    self.assertFalse(step.startswith(f'SCAN {table}'), f'{step}\nin plan of: {sql}')
+            steps.extend(plan)
+        self.assertTrue(steps)
+        return ' '.join(steps)
+
+    def test_metric_methods_use_indexes(self):
+        methods = {
+            'update_on_time_delivery_rate': 'po_vendor_status_idx',
+            'update_quality_rating_avg': 'po_vendor_rated_idx',
+            'update_average_response_time': 'po_vendor_acknowledged_idx',
+            'update_fulfillment_rate': 'INDEX',
+            'refresh_metrics': 'INDEX',
+        }
+        for name, index in methods.items():
+            vendor = Vendor.objects.get(pk='V1')
+            with self.subTest(method=name), CaptureQueriesContext(connection) as queries:
+                getattr(vendor, name)()
+                self.assertIn(index, self.assert_no_full_scans(queries.captured_queries))
+
+    def test_vendor_filtered_lists_use_indexes(self):
+        urls = {
+            '/api/purchase_orders/?vendor__vendor_code=V1': 'po_vendor_po_number_idx',
+            '/api/historical_performance/?vendor__vendor_code=V1&date__gte=2024-01-01T00:00:00Z': 'hp_vendor_date_idx',
+        }
+        for url, index in urls.items():
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertIn(index, self.assert_no_full_scans(queries.captured_queries))
+
+    def test_line_item_queries_use_indexes(self):
+        urls = {
+            '/api/line_items/?sku=A&open=true': 'po_item_sku_idx',
+            '/api/line_items/totals/?sku=A': 'COVERING INDEX po_item_sku_vendor_idx',
+            '/api/line_items/totals/?vendor=V1': 'COVERING INDEX po_item_vendor_sku_idx',
+        }
+        for url, index in urls.items():
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+                plan = self.assert_no_full_scans(queries.captured_queries)
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class RecomputeVendorMetricsTests(VendorTestMixin, TestCase):
+    def setUp(self):
+        self.vendors = [self.make_vendor(code) for code in ('A1', 'B1', 'C1')]
+        for number, vendor in enumerate(self.vendors):
+            self.make_order(vendor, f'PO{number}', status='Complete', quality_rating=float(number + 1),
+                            final_delivery_date=timezone.now())
+        # Simulate a data fix that bypassed the signals
+        PurchaseOrder.objects.filter(pk='PO1').update(quality_rating=5.0)
+        Vendor.objects.filter(pk='C1').update(fulfillment_rate=0)
+        VendorMetricAccumulator.objects.filter(vendor_id='C1').delete()
+
+    def test_recompute_writes_only_changed_vendors(self):
+        change_feed.clear()
+        history_count = HistoricalPerformance.objects.count()
+        output = StringIO()
+        # Three reads, five bulk writes and the savepoint around them, whatever the number of vendors
+        with self.assertNumQueries(10), self.captureOnCommitCallbacks(execute=True):
+            call_command('recompute_vendor_metrics', stdout=output)
+        self.assertIn('Updated metrics of 2 vendor(s) and 2 accumulator(s)', output.getvalue())
+        # The bulk-created snapshots are announced to the change feed
+        self.assertEqual(change_feed.latest_id, HistoricalPerformance.objects.latest('id').id)
+        self.assertEqual(HistoricalPerformance.objects.count(), history_count + 2)
+        self.assertEqual(Vendor.objects.get(pk='B1').quality_rating_avg, 5.0)
+        self.assertEqual(Vendor.objects.get(pk='C1').fulfillment_rate, 100)
+        call_command('verify_vendor_metrics', stdout=StringIO())
+
+    def test_recompute_limited_to_code_range(self):
+        output = StringIO()
+        call_command('recompute_vendor_metrics', '--from', 'B', '--to', 'C', stdout=output)
+        self.assertIn('Recomputed 1 vendor(s)', output.getvalue())
+        self.assertEqual(Vendor.objects.get(pk='C1').fulfillment_rate, 0)
+
+    def test_parallel_workers_are_refused_on_sqlite(self):
+        with self.assertRaisesMessage(CommandError, 'SQLite allows only one'):
+            call_command('recompute_vendor_metrics', '--workers', '2', stdout=StringIO())
+
+    def test_split_ranges_cover_all_vendors(self):
+        from .management.commands.recompute_vendor_metrics import Command
+        self.assertEqual(Command().split_ranges(None, None, 2), [(None, 'C1'), ('C1', None)])
+
+
+class VendorRankingTests(VendorTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(User.objects.create_user('tester'))
+        for code, rating, hours in (('A1', 5.0, 2), ('B1', 3.0, 30), ('C1', 3.0, 10), ('D1', 1.0, 50)):
+            vendor = self.make_vendor(code)
+            self.make_order(vendor, f'PO{code}', status='Complete', quality_rating=rating,
+                            final_delivery_date=timezone.now(), issue_date=timezone.now() - timedelta(hours=hours),
+                            acknowledgment_date=timezone.now())
+
+    def test_ranking_follows_metric_changes(self):
+        self.assertEqual(VendorRanking.objects.get(pk='A1').quality_rating_avg, 5.0)
+        PurchaseOrder.objects.get(pk='POA1').delete()
+        self.assertEqual(VendorRanking.objects.get(pk='A1').quality_rating_avg, 0)
+        Vendor.objects.get(pk='D1').delete()
+        self.assertFalse(VendorRanking.objects.filter(pk='D1').exists())
+
+    def test_recompute_rebuilds_rankings(self):
+        VendorRanking.objects.all().delete()
+        call_command('recompute_vendor_metrics', '--rankings', stdout=StringIO())
+        self.assertEqual(VendorRanking.objects.count(), 4)
+
+    def test_top_and_bottom_share_ranks_of_ties(self):
+        response = self.client.get('/api/vendor_rankings/?order_by=quality_rating_avg&top=3')
+        self.assertEqual(response.data['total'], 4)
+        self.assertEqual([(row['vendor'], row['rank']) for row in response.data['results']],
+                         [('A1', 1), ('B1', 2), ('C1', 2)])
+        self.assertEqual(response.data['results'][0]['percentile'], 100.0)
+
+        response = self.client.get('/api/vendor_rankings/?order_by=quality_rating_avg&bottom=2')
+        self.assertEqual([(row['vendor'], row['rank'], row['percentile']) for row in response.data['results']],
+                         [('C1', 2, 66.67), ('D1', 4, 0.0)])
+
+    def test_lower_response_time_ranks_first(self):
+        response = self.client.get('/api/vendor_rankings/?order_by=average_response_time&top=2')
+        self.assertEqual([row['vendor'] for row in response.data['results']], ['A1', 'C1'])
+        response = self.client.get('/api/vendor_rankings/?top=1')
+        self.assertEqual(response.data['order_by'], 'composite_score')
+        self.assertEqual(response.data['results'][0]['vendor'], 'A1')
+
+    def test_rejects_unknown_order_and_both_limits(self):
+        self.assertEqual(self.client.get('/api/vendor_rankings/?order_by=name').status_code, 400)
+        self.assertEqual(self.client.get('/api/vendor_rankings/?top=1&bottom=1').status_code, 400)
+
+    def test_total_is_cached_until_vendors_are_added_or_deleted(self):
+        self.assertEqual(self.client.get('/api/vendor_rankings/').data['total'], 4)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/vendor_rankings/?top=2')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.make_vendor('E1')
+        self.assertEqual(self.client.get('/api/vendor_rankings/').data['total'], 5)
+        Vendor.objects.filter(pk__in=['D1', 'E1']).delete()
+        self.assertEqual(self.client.get('/api/vendor_rankings/').data['total'], 3)
+
+    def test_page_reads_through_ranking_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/vendor_rankings/?order_by=on_time_delivery_rate&bottom=2')
+        plans = []
+        for query in queries.captured_queries:
+            if 'testapp_vendorranking' in query['sql'] and 'ORDER BY' in query['sql']:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.extend(row[-1] for row in cursor.fetchall())
+        self.assertIn('ranking_on_time_idx', ' '.join(plans))
+        self.assertNotIn('TEMP B-TREE', ' '.join(plans))
+        # The bottom page's rank is counted over an index range, not the whole table
+        self.client.get('/api/vendor_rankings/?order_by=on_time_delivery_rate&bottom=2')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/vendor_rankings/?order_by=on_time_delivery_rate&bottom=2')
+        counts = [query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']]
+        self.assertEqual(len(counts), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + counts[0])
+            self.assertTrue(all(row[-1].startswith('SEARCH') for row in cursor.fetchall()))
@@ -1,15 +1,31 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import include, path
-from .views import VendorViewSet, PurchaseOrderViewSet, HistoricalPerformanceViewSet
+from . import async_views
+from .views import VendorViewSet, PurchaseOrderViewSet, HistoricalPerformanceViewSet, \
+    VendorRankingViewSet, PurchaseOrderItemViewSet, MetricsView
 
 # This router redirects to the respective vendors or purchase_orders page from root /api/
 router = DefaultRouter()
 router.register(r'vendors', VendorViewSet)
 router.register(r'purchase_orders', PurchaseOrderViewSet)
 router.register(r'historical_performance', HistoricalPerformanceViewSet)
+router.register(r'vendor_rankings', VendorRankingViewSet, basename='vendor-ranking')
+router.register(r'line_items', PurchaseOrderItemViewSet)
 
 
 
+# Async read-only versions of the busiest endpoints, for polling clients when served under ASGI
+async_urlpatterns = [
+    path('vendors/<str:vendor_code>/', async_views.vendor_detail, name='async-vendor-detail'),
+    path('vendors/<str:vendor_code>/performance/', async_views.vendor_performance, name='async-vendor-performance'),
+    path('purchase_orders/', async_views.purchase_order_list, name='async-purchase-order-list'),
+    path('historical_performance/', async_views.historical_performance_list,
+         name='async-historical-performance-list'),
+    path('historical_performance/feed/', async_views.performance_feed, name='async-performance-feed'),
+]
+
 urlpatterns = [
+    path('api/metrics', MetricsView.as_view(), name='metrics'),
+    path('api/async/', include(async_urlpatterns)),
     path('api/', include(router.urls)),
 ]
@@ -1,42 +1,220 @@
-from rest_framework import viewsets
+from rest_framework import viewsets, serializers
+from rest_framework.views import APIView
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BrowsableAPIRenderer
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 from django.utils import timezone
+from datetime import timedelta
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import status
-from django.db.models import F, Avg, ExpressionWrapper
-from .models import Vendor, PurchaseOrder, HistoricalPerformance
-from .serializer import VendorSerializer, PurchaseOrderSerializer, HistoricalPerformanceSerializer
+from django.db.models import F, Q, Avg, Count, Sum, ExpressionWrapper
+from .models import Vendor, PurchaseOrder, PurchaseOrderItem, HistoricalPerformance, VendorRanking
+from .serializer import VendorSerializer, PurchaseOrderSerializer, PurchaseOrderBulkSerializer, \
+    PurchaseOrderNumbersSerializer, HistoricalPerformanceSerializer, PerformanceSeriesQuerySerializer, \
+    PerformanceAsOfSerializer, VendorRankingSerializer, VendorRankingQuerySerializer, PurchaseOrderItemSerializer, \
+    PurchaseOrderItemQuerySerializer
+from .parsers import NDJSONParser
+from .renderers import FastJSONRenderer
+from .fast_serialization import row_converter
+from .pagination import PurchaseOrderPagination, HistoricalPerformancePagination, PurchaseOrderItemPagination
+from .exports import stream_export
+from .performance_cache import get_performance_entry, get_performance_entries, get_ranking_total
+from .rollups import METRIC_FIELDS, STATISTICS, choose_resolution, resolution_for_points, performance_series, \
+    metrics_as_of
+from .signals import mark_vendor_dirty
+from .instrumentation import registry
+from .database import read_alias
+
+
+# Reads the querysets of the listed actions from the read replica (see testapp/database.py).
+class ReplicaReadMixin:
+    replica_actions = ('list', 'export')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.using(read_alias()) if self.action in self.replica_actions else queryset
+
+
+# Serves the list action from QuerySet.values() rows converted by the serializer's precompiled RowConverter instead
+# of a ModelSerializer per row, rendering the same JSON. FAST_LIST_SERIALIZATION = False turns it off.
+class FastListMixin:
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        converter = row_converter(self.get_serializer_class())
+        if converter is None or not getattr(settings, 'FAST_LIST_SERIALIZATION', True):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).values(*converter.columns)
+        self.plain_json = True
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(converter.convert(page))
+        return Response(converter.convert(queryset))
 
 
 # Manages CRUD operations for Vendor instances with a custom performance retrieval action.
-class VendorViewSet(viewsets.ModelViewSet):
+class VendorViewSet(FastListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Vendor.objects.all()
     serializer_class = VendorSerializer
 
-    # Returns performance metrics for a Vendor instance.
+    # Deletes the vendor's purchase orders in raw batches first, so the cascade does not load and signal each one
+    def perform_destroy(self, instance):
+        Vendor.objects.filter(pk=instance.pk).bulk_delete()
+
+    # Returns performance metrics for a Vendor instance. Metrics are served from the performance cache and carry
+    # ETag and Last-Modified headers, so a client polling an unchanged vendor gets a 304 Not Modified. With
+    # ?as_of=<timestamp> the metrics of the latest historical snapshot at or before that time are returned instead.
     @action(detail=True, methods=['get'], url_path='performance')
     def performance(self, request, pk=None):
-        vendor = self.get_object()  # Retrieves the Vendor based on vendor_code
-        # Extracting performance metrics
-        performance_data = {
-            'on_time_delivery_rate': vendor.on_time_delivery_rate,
-            'quality_rating_avg': vendor.quality_rating_avg,
-            'average_response_time': vendor.average_response_time,
-            'fulfillment_rate': vendor.fulfillment_rate
-        }
-        return Response(performance_data, status=status.HTTP_200_OK)
+        as_of = self.as_of(request.query_params)
+        if as_of is not None:
+            metrics = metrics_as_of([pk], as_of).get(pk)
+            if metrics is None:
+                get_object_or_404(Vendor, pk=pk)
+                raise Http404('No performance snapshot at or before as_of.')
+            return Response(metrics, status=status.HTTP_200_OK)
+
+        entry = get_performance_entry(pk)
+        if entry is None:
+            raise Http404('No Vendor matches the given query.')
+        last_modified = int(entry['last_modified'].timestamp()) if entry['last_modified'] else None
+        response = get_conditional_response(request._request, etag=entry['etag'], last_modified=last_modified)
+        if response is None:
+            response = Response(entry['metrics'], status=status.HTTP_200_OK)
+        response['ETag'] = entry['etag']
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    # Returns performance metrics for many vendors in one request, from ?vendor_codes=A,B or a POSTed list,
+    # optionally as of a point in time.
+    @action(detail=False, methods=['get', 'post'], url_path='performance-bulk')
+    def performance_bulk(self, request):
+        if request.method == 'POST':
+            params = request.data if isinstance(request.data, dict) else {}
+            vendor_codes = params.get('vendor_codes')
+        else:
+            params = request.query_params
+            vendor_codes = [code for code in params.get('vendor_codes', '').split(',') if code]
+        if not isinstance(vendor_codes, list) or not vendor_codes:
+            return Response({'vendor_codes': ['A non-empty list of vendor codes is required.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        vendor_codes = list(dict.fromkeys(str(code) for code in vendor_codes))
+        as_of = self.as_of(params)
+        if as_of is not None:
+            metrics = metrics_as_of(vendor_codes, as_of)
+        else:
+            metrics = {code: entry['metrics'] for code, entry in get_performance_entries(vendor_codes).items()}
+        return Response({
+            'vendors': {code: metrics[code] for code in vendor_codes if code in metrics},
+            'missing': [code for code in vendor_codes if code not in metrics],
+        }, status=status.HTTP_200_OK)
+
+    # Returns the validated as_of timestamp of the performance endpoints, or None when it is not given
+    def as_of(self, params):
+        query = PerformanceAsOfSerializer(data={'as_of': params['as_of']} if params.get('as_of') else {})
+        query.is_valid(raise_exception=True)
+        return query.validated_data.get('as_of')
 
 
 # Manages CRUD operations for PurchaseOrder instances with support for acknowledging and completing orders.
-class PurchaseOrderViewSet(viewsets.ModelViewSet):
+class PurchaseOrderViewSet(FastListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = PurchaseOrder.objects.all()
     serializer_class = PurchaseOrderSerializer
+    pagination_class = PurchaseOrderPagination
 
     # This function is used to obtain purchase orders by querying vendor_code.
     filter_backends = (DjangoFilterBackend,)
     filterset_fields = ['vendor__vendor_code']
 
+    # Number of rows validated against the database and inserted per batch by the bulk action
+    bulk_batch_size = 500
+
+    # Creates many purchase orders from a JSON array or NDJSON body, updating existing ones with ?upsert=true.
+    # Vendors and existing orders are looked up with one IN query per batch, rows are written with bulk_create and
+    # metrics are recomputed once per affected vendor. The response reports the outcome of every row.
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'detail': 'Expected a JSON array or NDJSON body of purchase orders.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        upsert = request.query_params.get('upsert', '').lower() in ('1', 'true', 'yes')
+
+        results = [None] * len(rows)
+        valid = {}
+        validator = PurchaseOrderBulkSerializer()
+        for index, row in enumerate(rows):
+            po_number = row.get('po_number') if isinstance(row, dict) else None
+            try:
+                data = validator.run_validation(row)
+            except ValidationError as exc:
+                results[index] = {'index': index, 'po_number': po_number, 'status': 'error', 'errors': exc.detail}
+                continue
+            if data['po_number'] in valid:
+                results[index] = {'index': index, 'po_number': po_number, 'status': 'error',
+                                  'errors': {'po_number': ['Duplicate po_number in this request.']}}
+                continue
+            valid[data['po_number']] = (index, data)
+
+        update_fields = [field.name for field in PurchaseOrder._meta.concrete_fields if not field.primary_key]
+        pending = list(valid.items())
+        with transaction.atomic():
+            for start in range(0, len(pending), self.bulk_batch_size):
+                batch = pending[start:start + self.bulk_batch_size]
+                vendor_codes = set(Vendor.objects.filter(
+                    pk__in={data['vendor'] for _, (_, data) in batch}).values_list('pk', flat=True))
+                existing = dict(PurchaseOrder.objects.filter(
+                    pk__in=[po_number for po_number, _ in batch]).values_list('pk', 'vendor_id'))
+
+                orders, affected_vendors = [], set()
+                for po_number, (index, data) in batch:
+                    result = {'index': index, 'po_number': po_number}
+                    vendor_code = data.pop('vendor')
+                    if vendor_code not in vendor_codes:
+                        result.update(status='error', errors={
+                            'vendor': [f'Invalid pk "{vendor_code}" - object does not exist.']})
+                    elif po_number in existing and not upsert:
+                        result.update(status='error', errors={
+                            'po_number': ['purchase order with this po number already exists.']})
+                    else:
+                        result['status'] = 'updated' if po_number in existing else 'created'
+                        orders.append(PurchaseOrder(vendor_id=vendor_code, **data))
+                        affected_vendors.add(vendor_code)
+                        if po_number in existing:
+                            affected_vendors.add(existing[po_number])
+                    results[index] = result
+
+                if upsert:
+                    PurchaseOrder.objects.bulk_create(orders, update_conflicts=True, unique_fields=['po_number'],
+                                                      update_fields=update_fields)
+                else:
+                    PurchaseOrder.objects.bulk_create(orders)
+                PurchaseOrderItem.sync(orders, replace=upsert)
+                # bulk_create sends no signals, so each affected vendor is recomputed once when the import commits
+                for vendor_code in affected_vendors:
+                    mark_vendor_dirty(vendor_code)
+
+        counts = {outcome: sum(1 for result in results if result['status'] == outcome)
+                  for outcome in ('created', 'updated', 'error')}
+        return Response({'created': counts['created'], 'updated': counts['updated'], 'failed': counts['error'],
+                         'results': results}, status=status.HTTP_200_OK)
+
+    # Streams the (filtered) purchase orders as CSV or NDJSON, ordered by po_number.
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<export_format>csv|ndjson)')
+    def export(self, request, export_format=None):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('po_number')
+        columns = {field.name: field.attname for field in PurchaseOrder._meta.concrete_fields}
+        return stream_export(queryset, columns, export_format, 'purchase_orders')
+
     # Sets acknowledgment date for a PurchaseOrder.
     @action(detail=True, methods=['get','post'])
     def acknowledge(self, request, pk=None):
@@ -56,17 +234,219 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         serializer = PurchaseOrderSerializer(purchase_order)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    # Sets the acknowledgment date of every listed PurchaseOrder.
+    @action(detail=False, methods=['post'], url_path='acknowledge-bulk')
+    def acknowledge_bulk(self, request):
+        return self.update_many(request, acknowledgment_date=timezone.now())
+
+    # Marks every listed PurchaseOrder as complete.
+    @action(detail=False, methods=['post'], url_path='complete-bulk')
+    def complete_bulk(self, request):
+        return self.update_many(request, final_delivery_date=timezone.now(), status='Complete')
+
+    # Deletes every listed PurchaseOrder with raw batched DELETEs instead of one signalled delete per order, then
+    # recomputes metrics once per distinct vendor. Reports which po_numbers were deleted and which are missing.
+    @action(detail=False, methods=['post'], url_path='delete-bulk')
+    def delete_bulk(self, request):
+        serializer = PurchaseOrderNumbersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        po_numbers = list(dict.fromkeys(serializer.validated_data['po_numbers']))
+
+        deleted = {}
+        with transaction.atomic():
+            for start in range(0, len(po_numbers), self.bulk_batch_size):
+                orders = PurchaseOrder.objects.filter(pk__in=po_numbers[start:start + self.bulk_batch_size])
+                deleted.update(orders.values_list('pk', 'vendor_id'))
+                orders.bulk_delete(recompute=False)
+            for vendor_code in set(deleted.values()):
+                mark_vendor_dirty(vendor_code)
+
+        return Response({
+            'deleted': [po_number for po_number in po_numbers if po_number in deleted],
+            'missing': [po_number for po_number in po_numbers if po_number not in deleted],
+        }, status=status.HTTP_200_OK)
+
+    # Applies the same changes to the purchase orders named in the po_numbers list with one UPDATE per batch, then
+    # recomputes metrics once per distinct vendor. Reports which po_numbers were matched and which are missing.
+    def update_many(self, request, **changes):
+        serializer = PurchaseOrderNumbersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        po_numbers = list(dict.fromkeys(serializer.validated_data['po_numbers']))
+
+        matched = {}
+        with transaction.atomic():
+            for start in range(0, len(po_numbers), self.bulk_batch_size):
+                orders = PurchaseOrder.objects.filter(pk__in=po_numbers[start:start + self.bulk_batch_size])
+                found = dict(orders.select_for_update().values_list('pk', 'vendor_id'))
+                if found:
+                    orders.update(**changes)
+                matched.update(found)
+            # QuerySet.update sends no signals, so each vendor is recomputed once when the transaction commits
+            for vendor_code in set(matched.values()):
+                mark_vendor_dirty(vendor_code)
+
+        return Response({
+            'matched': [po_number for po_number in po_numbers if po_number in matched],
+            'missing': [po_number for po_number in po_numbers if po_number not in matched],
+        }, status=status.HTTP_200_OK)
+
 
 # Provides read-only access to HistoricalPerformance data with filtering by vendor_code.
-class HistoricalPerformanceViewSet(viewsets.ReadOnlyModelViewSet):
+class HistoricalPerformanceViewSet(FastListMixin, ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = HistoricalPerformance.objects.all()
     serializer_class = HistoricalPerformanceSerializer
+    pagination_class = HistoricalPerformancePagination
     filter_backends = (DjangoFilterBackend,)
-    filterset_fields = ['vendor__vendor_code']
+    filterset_fields = {'vendor__vendor_code': ['exact'], 'date': ['gte', 'lte']}
+
+    # Streams the (filtered) historical performance rows as CSV or NDJSON, in the order they were recorded.
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<export_format>csv|ndjson)')
+    def export(self, request, export_format=None):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        columns = {field.name: field.attname for field in HistoricalPerformance._meta.concrete_fields}
+        return stream_export(queryset, columns, export_format, 'historical_performance')
 
-    # Function to bulk delete all HistoricalPerformance entries for a particular vendor to allow vendor deletion
+    # Most buckets a series returns when the client gives neither step nor resolution
+    series_max_points = 500
+
+    # Returns a vendor's metrics over a time range as min/max/avg/last per bucket. The bucket size is the coarsest
+    # stored resolution (hour, day or month) no wider than the requested step, or by default the finest one that
+    # fits the range in series_max_points buckets, so long ranges read few rows.
+    @action(detail=False, methods=['get'], url_path='series')
+    def series(self, request):
+        query = PerformanceSeriesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        end = params.get('end') or timezone.now()
+        start = params.get('start') or end - timedelta(days=365)
+        if start > end:
+            return Response({'start': ['Must not be after end.']}, status=status.HTTP_400_BAD_REQUEST)
+        if 'resolution' in params:
+            resolution = params['resolution']
+        elif 'step' in params:
+            resolution = choose_resolution(timedelta(seconds=params['step']))
+        else:
+            resolution = resolution_for_points(end - start, self.series_max_points)
+
+        date_field = serializers.DateTimeField()
+        buckets = [
+            {
+                'bucket_start': date_field.to_representation(bucket['bucket_start']),
+                'samples': bucket['samples'],
+                **{name: {statistic: bucket[f'{name}_{statistic}'] for statistic in STATISTICS}
+                   for name in METRIC_FIELDS},
+            }
+            for bucket in performance_series(params['vendor__vendor_code'], start, end, resolution)
+        ]
+        return Response({
+            'vendor': params['vendor__vendor_code'],
+            'resolution': resolution,
+            'start': date_field.to_representation(start),
+            'end': date_field.to_representation(end),
+            'buckets': buckets,
+        }, status=status.HTTP_200_OK)
+
+    # Function to bulk delete the HistoricalPerformance entries matching the list filters, e.g. of one vendor within
+    # a ?date__gte / ?date__lte range. Invalid filter values are rejected with 400 before anything is deleted.
     @action(detail=False, methods=['delete'], url_path='delete-bulk')
     def delete_bulk(self, request):
-        filters = {key: request.query_params[key] for key in request.query_params if key in self.filterset_fields}
-        self.queryset.filter(**filters).delete()
+        self.filter_queryset(self.get_queryset()).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# Serves the vendor leaderboard from the precomputed ranking table. Rows are read through the (metric, vendor)
+# indexes, so a top-N or bottom-N page reads N rows whatever the number of vendors.
+class VendorRankingViewSet(ReplicaReadMixin, viewsets.GenericViewSet):
+    queryset = VendorRanking.objects.select_related('vendor')
+    serializer_class = VendorRankingSerializer
+
+    # Rows returned when the client gives neither top nor bottom
+    default_top = 10
+
+    # Returns the best (?top=N) or worst (?bottom=N) vendors by ?order_by=<metric>, in rank order. Tied vendors
+    # share a rank, and the percentile is the share of the other vendors ranked below.
+    def list(self, request):
+        query = VendorRankingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        field = params['order_by']
+        ascending = field in VendorRanking.LOWER_IS_BETTER
+        best_first = (field if ascending else f'-{field}', 'vendor')
+        worst_first = (f'-{field}' if ascending else field, '-vendor')
+
+        queryset = self.get_queryset()
+        total = get_ranking_total()
+        if 'bottom' in params:
+            rankings = list(queryset.order_by(*worst_first)[:params['bottom']])[::-1]
+        else:
+            rankings = list(queryset.order_by(*best_first)[:params.get('top', self.default_top)])
+
+        if rankings:
+            # Vendors past the first tie group of the page are ranked from their position; only the first group,
+            # which may continue above a bottom-N page, needs the database. The vendors strictly better are the
+            # total less those ranked at or below it, counted from the worst end of the index: a range as long as
+            # the page plus its ties.
+            first_value = getattr(rankings[0], field)
+            offset = total - len(rankings) if 'bottom' in params else 0
+            rank = 1
+            if 'bottom' in params:
+                not_better = {f'{field}__gte' if ascending else f'{field}__lte': first_value}
+                rank = 1 + total - queryset.filter(**not_better).count()
+            previous = first_value
+            for position, ranking in enumerate(rankings):
+                value = getattr(ranking, field)
+                if value != previous:
+                    rank = 1 + offset + position
+                ranking.rank = rank
+                ranking.percentile = round(100 * (total - rank) / (total - 1), 2) if total > 1 else 100.0
+                previous = value
+
+        return Response({
+            'order_by': field,
+            'total': total,
+            'results': self.get_serializer(rankings, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
+# Answers SKU and vendor questions about purchase order contents from the indexed line item table, e.g. which open
+# orders contain a SKU or how much of a SKU each vendor was ordered.
+class PurchaseOrderItemViewSet(ReplicaReadMixin, viewsets.GenericViewSet):
+    queryset = PurchaseOrderItem.objects.select_related('purchase_order').only(
+        'id', 'purchase_order__status', 'vendor_id', 'line', 'sku', 'quantity')
+    serializer_class = PurchaseOrderItemSerializer
+    pagination_class = PurchaseOrderItemPagination
+    replica_actions = ('list', 'totals')
+
+    # Validates the ?sku, ?vendor and ?open filters, requiring at least one of the given fields
+    def filtered_queryset(self, request, required):
+        query = PurchaseOrderItemQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        if not any(name in params for name in required):
+            raise ValidationError({name: ['This field is required.'] for name in required})
+        queryset = self.get_queryset()
+        if 'sku' in params:
+            queryset = queryset.filter(sku=params['sku'])
+        if 'vendor' in params:
+            queryset = queryset.filter(vendor_id=params['vendor'])
+        if params.get('open'):
+            queryset = queryset.filter(~Q(purchase_order__status='Complete'))
+        return queryset
+
+    # Lists the line items of a ?sku, optionally of one ?vendor and of open orders only, paged by id.
+    def list(self, request):
+        page = self.paginate_queryset(self.filtered_queryset(request, ['sku']))
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    # Returns the number of lines and the total quantity per vendor and SKU, for a ?sku, a ?vendor or both.
+    @action(detail=False, methods=['get'])
+    def totals(self, request):
+        totals = self.filtered_queryset(request, ['sku', 'vendor']).values('vendor', 'sku') \
+            .annotate(lines=Count('id'), quantity=Sum('quantity')).order_by('vendor', 'sku')
+        return Response(list(totals), status=status.HTTP_200_OK)
+
+
+# Exposes the per-view request, query and Vendor update metrics collected in this process in Prometheus text format.
+class MetricsView(APIView):
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'testapp.instrumentation.RequestMetricsMiddleware',
+    'testapp.database.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +86,11 @@ DATABASES = {
     }
 }
 
+# History reads, list endpoints and exports use the database alias named by REPLICA_DATABASE when it is defined
+# in DATABASES, except in requests that already wrote to the primary (see testapp/database.py)
+DATABASE_ROUTERS = ['testapp.database.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -106,7 +113,7 @@ AUTH_PASSWORD_VALIDATORS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'testapp.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -116,6 +123,59 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Default and maximum page sizes of the cursor-paginated purchase order and historical performance lists
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+# How purchase order changes refresh vendor metrics:
+# 'sync' applies each change immediately, 'on_commit' recomputes every touched vendor once when the transaction
+# commits, and 'queue' only marks vendors dirty for the process_dirty_vendors management command to recompute.
+VENDOR_METRICS_MODE = 'sync'
+
+# Relative weights of each metric in the vendor ranking composite score, and the maximum quality rating used to
+# scale quality_rating_avg to 0-100.
+VENDOR_RANKING_WEIGHTS = {
+    'on_time_delivery_rate': 0.35,
+    'quality_rating_avg': 0.35,
+    'average_response_time': 0.1,
+    'fulfillment_rate': 0.2,
+}
+VENDOR_QUALITY_RATING_SCALE = 5
+
+
+# Caches. Vendor performance responses are cached in VENDOR_PERFORMANCE_CACHE (an alias below) for
+# VENDOR_PERFORMANCE_CACHE_TIMEOUT seconds and invalidated whenever a vendor is written. Point the alias at a
+# shared backend (e.g. Redis or Memcached) when running several processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+VENDOR_PERFORMANCE_CACHE = 'default'
+VENDOR_PERFORMANCE_CACHE_TIMEOUT = 300
+
+# Seconds between the change feed's checks for snapshots written by other processes, and between the keepalive
+# comments of an idle server-sent event stream
+CHANGE_FEED_POLL_INTERVAL = 2
+CHANGE_FEED_HEARTBEAT = 15
+
+# Serve the list endpoints from QuerySet.values() rows and precompiled field converters instead of model instances
+# and serializers; the responses are byte-for-byte the same either way
+FAST_LIST_SERIALIZATION = True
+
+# Seconds and entries of the per-process token cache of CachedTokenAuthentication (a TTL of 0 disables it), the
+# alias of an optional cache shared between processes, e.g. Redis or Memcached, and the seconds entries stay in the
+# per-process cache in front of the shared one (how long other processes may accept a revoked token)
+AUTH_TOKEN_CACHE_TTL = 60
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_SHARED_CACHE = None
+AUTH_TOKEN_LOCAL_TTL = 5
+
+# Requests slower than this many milliseconds are logged to the 'testapp.requests' logger with their slowest SQL.
+# Set to None to disable the slow-request log.
+SLOW_REQUEST_THRESHOLD_MS = 1000
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -0,0 +1,45 @@
+"""
+Production settings profile for testproject.
+
+Use it with DJANGO_SETTINGS_MODULE=testproject.settings_production. It keeps everything from settings.py and
+tunes SQLite for concurrent readers and writers: WAL journaling, synchronous=NORMAL, a busy timeout and
+persistent connections. Set VENDOR_REPLICA_DB_PATH to the path of a read replica (a copy of the primary kept up
+to date by e.g. Litestream or periodic `sqlite3 .backup`) to route history reads, lists and exports to it.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', SECRET_KEY)  # noqa: F405
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('VENDOR_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        # Keep connections open between requests, checking them before reuse
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+if os.environ.get('VENDOR_REPLICA_DB_PATH'):
+    DATABASES[REPLICA_DATABASE] = {  # noqa: F405
+        **DATABASES['default'],
+        'NAME': os.environ['VENDOR_REPLICA_DB_PATH'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Applied to every new SQLite connection by testapp.database.configure_sqlite. In WAL mode readers do not block
+# the writer (and the other way round), synchronous=NORMAL only syncs at checkpoints, and busy_timeout makes a
+# connection wait up to that many milliseconds for a lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}